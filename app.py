@@ -1,68 +1,22 @@
-from flask import Flask, render_template, request, redirect, url_for
-from datetime import datetime
+from flask import Flask, current_app, render_template, stream_template, request, redirect, url_for, abort, jsonify
+from werkzeug.http import is_resource_modified
+from datetime import datetime, timedelta, timezone
+import glob
+import hashlib
 import sqlite3
 import uuid
 import os
 
-app = Flask(__name__)
-DB_FILE = "database.db"
-
-# أسعار القناني حسب نوع الزبون
-PRICES = {
-    0: {'large': 3330, 'medium': 1600, 'small': 730},
-    1: {'large': 3130, 'medium': 1505, 'small': 685},
-    2: {'large': 3200, 'medium': 1535, 'small': 700},
-}
-
-WEIGHTS = {'large': 12, 'medium': 6, 'small': 2.7}
-
-def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id TEXT PRIMARY KEY,
-            datetime TEXT,
-            customer_type INTEGER,
-            large_qty INTEGER,
-            medium_qty INTEGER,
-            small_qty INTEGER,
-            total_price REAL,
-            total_gas REAL
-        )
-        """)
-
-# استدعاء قاعدة البيانات
-init_db()
-
-def insert_transaction(data):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute("""
-            INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            data['id'], data['datetime'], data['customer_type'],
-            data['large_qty'], data['medium_qty'], data['small_qty'],
-            data['total_price'], data['total_gas']
-        ))
-
-def get_transactions_by_date(date):
-    with sqlite3.connect(DB_FILE) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM transactions WHERE datetime LIKE ?", (f"{date}%",))
-        rows = cur.fetchall()
-    return rows
-
-def delete_transaction_by_id(transaction_id):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
-
-def get_summary_by_date(date):
-    with sqlite3.connect(DB_FILE) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT SUM(total_price), SUM(total_gas) FROM transactions WHERE datetime LIKE ?", (f"{date}%",))
-        result = cur.fetchone()
-    return result if result else (0, 0)
-
-@app.route("/", methods=["GET", "POST"])
+import numpy as np
+
+import bulk
+import instrumentation
+import page_cache
+import pricing
+import reports
+import storage
+import writer
+
 def index():
     message = None
     if request.method == "POST":
@@ -71,9 +25,8 @@ def index():
         medium_qty = int(request.form["medium_qty"])
         small_qty = int(request.form["small_qty"])
 
-        price_table = PRICES[customer_type]
-        total_price = large_qty * price_table['large'] + medium_qty * price_table['medium'] + small_qty * price_table['small']
-        total_gas = (large_qty * WEIGHTS['large'] + medium_qty * WEIGHTS['medium'] + small_qty * WEIGHTS['small']) / 1000
+        with instrumentation.span("pricing"):
+            total_price, total_gas = pricing.get_price_book().quote(customer_type, large_qty, medium_qty, small_qty)
 
         transaction = {
             "id": str(uuid.uuid4()),
@@ -86,28 +39,257 @@ def index():
             "total_gas": total_gas
         }
 
-        insert_transaction(transaction)
+        writer.write([storage.to_row(transaction)])
         message = f"✅ تم تسجيل المعاملة بنجاح. المبلغ: {total_price} MRU"
 
     return render_template("index.html", message=message)
 
-@app.route("/summary/<date>")
+# إدخال دفعة من المبيعات (JSON) في معاملة واحدة
+MAX_BATCH_SALES = 5000
+BACKFILL_DAYS = 7
+
+def create_transactions():
+    payload = request.get_json(silent=True)
+    sales = payload.get("sales") if isinstance(payload, dict) else payload
+    if not isinstance(sales, list) or not sales:
+        return jsonify(error="expected a non-empty list of sales"), 400
+    if len(sales) > MAX_BATCH_SALES:
+        return jsonify(error=f"at most {MAX_BATCH_SALES} sales per request"), 413
+
+    # المبيعات المتأخرة (مزامنة المستودعات) مقبولة لأيام قليلة فقط، وليس في المستقبل
+    now = datetime.now()
+    today = now.strftime(storage.DATE_FORMAT)
+    earliest = (now - timedelta(days=current_app.config["BACKFILL_DAYS"])).strftime(storage.DATE_FORMAT)
+    stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    positions, parsed, errors = [], [], []
+    for position, sale in enumerate(sales):
+        if not isinstance(sale, dict):
+            errors.append({"index": position, "error": "sale must be an object"})
+            continue
+        record = dict(sale, id=sale.get("id") or str(uuid.uuid4()), datetime=sale.get("datetime") or stamp)
+        try:
+            row = bulk.parse_record(record)
+        except bulk.InvalidRow as exc:
+            errors.append({"index": position, "error": str(exc)})
+            continue
+        if not earliest <= row[1][:10] <= today:
+            errors.append({"index": position, "error": f"datetime must be between {earliest} and {today}"})
+            continue
+        parsed.append(row)
+        positions.append(position)
+    # السعر يُحسب دائما في الخادم
+    with instrumentation.span("pricing"):
+        rows, rejected, _ = bulk.price_records(pricing.get_price_book(), parsed, recompute=True)
+    errors += [{"index": positions[i], "error": message} for i, message in rejected]
+    if errors:
+        return jsonify(errors=sorted(errors, key=lambda error: error["index"])), 400
+
+    try:
+        flags = writer.write(rows)
+    except sqlite3.IntegrityError as exc:
+        return jsonify(error=str(exc)), 400
+    inserted = [row for row, flag in zip(rows, flags) if flag]
+    return jsonify(
+        committed=True,
+        inserted=len(inserted),
+        duplicates=len(rows) - len(inserted),
+        ids=[row[0] for row in rows],
+        total_price=sum(row[6] for row in inserted),
+        total_gas=sum(row[7] for row in inserted),
+    ), 201
+
+# معاينة الأسعار دون تسجيل، بنفس التحقق المستعمل عند التسجيل
+QUOTE_FIELDS = ("customer_type", "large_qty", "medium_qty", "small_qty")
+
+def quote():
+    payload = request.get_json(silent=True)
+    sales = payload.get("sales") if isinstance(payload, dict) else payload
+    if not isinstance(sales, list) or not sales:
+        return jsonify(error="expected a non-empty list of sales"), 400
+    if len(sales) > MAX_BATCH_SALES:
+        return jsonify(error=f"at most {MAX_BATCH_SALES} sales per request"), 413
+    date = payload.get("date") if isinstance(payload, dict) else None
+    if date is not None:
+        try:
+            storage.day_range(date)
+        except (TypeError, ValueError):
+            return jsonify(error="date must be YYYY-MM-DD"), 400
+
+    parsed, errors = [], []
+    for position, sale in enumerate(sales):
+        if not isinstance(sale, dict):
+            errors.append({"index": position, "error": "sale must be an object"})
+            continue
+        try:
+            parsed.append([bulk.parse_int(sale, field) for field in QUOTE_FIELDS])
+        except bulk.InvalidRow as exc:
+            errors.append({"index": position, "error": str(exc)})
+    if errors:
+        return jsonify(errors=errors), 400
+
+    with instrumentation.span("pricing"):
+        prices, gas = pricing.get_price_book().quote_batch(*zip(*parsed), dates=date)
+    unpriced = np.isnan(prices)
+    return jsonify(
+        quotes=[{"total_price": None if missing else price, "total_gas": weight}
+                for price, weight, missing in zip(prices.tolist(), gas.tolist(), unpriced.tolist())],
+        total_price=float(prices[~unpriced].sum()),
+        total_gas=float(gas.sum()),
+    )
+
+def writer_stats():
+    return jsonify(writer.get_writer().stats())
+
+# تقارير أسبوعية وشهرية وسنوية
+def report():
+    start, end = request.args.get("start"), request.args.get("end")
+    period = request.args.get("period", "month")
+    by_type = request.args.get("by") == "customer_type"
+    try:
+        reports.check_range(start, end)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    if period not in reports.PERIODS:
+        return jsonify(error=f"period must be one of {', '.join(reports.PERIODS)}"), 400
+    with instrumentation.span("reports"):
+        frame = reports.load_range(storage.get_db(), start, end, reports.get_snapshots())
+        rows = reports.aggregate(frame, period, by_type)
+    return jsonify(start=start, end=end, period=period, rows=reports.to_records(rows))
+
+def report_year_over_year():
+    year = request.args.get("year", type=int)
+    period = request.args.get("period", "month")
+    if year is None:
+        return jsonify(error="year is required"), 400
+    try:
+        reports.check_year(year)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    if period not in reports.YOY_SLOTS:
+        return jsonify(error=f"period must be one of {', '.join(reports.YOY_SLOTS)}"), 400
+    rows = reports.year_over_year(storage.get_db(), year, period, reports.get_snapshots())
+    return jsonify(year=year, period=period, rows=reports.to_records(rows))
+
+STREAM_BUFFER_SIZE = 8192
+
+def _tee(chunks, done):
+    # Jinja يُخرج قطعا صغيرة جدا؛ نجمعها حتى لا يكلف كل سطر عملية كتابة
+    parts, pending, size = [], [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_BUFFER_SIZE:
+            yield "".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield "".join(pending)
+    done("".join(parts))
+
 def summary(date):
-    rows = get_transactions_by_date(date)
-    total_price, total_gas = get_summary_by_date(date)
+    try:
+        storage.day_range(date)
+    except ValueError:
+        abort(404)
+    after = None
+    if request.args.get("after_time") and request.args.get("after_id"):
+        after = (request.args["after_time"], request.args["after_id"])
     is_today = (date == datetime.now().strftime("%Y-%m-%d"))
-    return render_template("daily_summary.html", rows=rows, date=date, total_price=total_price, total_gas=total_gas, is_today=is_today)
 
-@app.route("/delete/<id>/<date>", methods=["POST"])
+    # الصفحة لا تتغير إلا إذا تغير إصدار اليوم، لذلك يكفي الإصدار لبناء الـ ETag
+    conn = storage.get_db()
+    version, updated_at = storage.get_day_version(conn, date)
+    key = (date, after, is_today)
+    etag = hashlib.sha1(repr((key, version, current_app.config["SUMMARY_PAGE_SIZE"],
+                              current_app.config["BUILD_ID"])).encode()).hexdigest()
+    last_modified = None
+    if updated_at and not is_today:
+        last_modified = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+    def finish(response):
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # الأيام الماضية قد تتغير أيضا (استيراد، مزامنة متأخرة)، لذلك يتحقق
+        # المتصفح دائما؛ الرد 304 لا يكلف إلا قراءة day_changes
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return finish(current_app.response_class(status=304))
+
+    cache = page_cache.get_page_cache()
+    body = cache.get(key, etag)
+    if body is not None:
+        return finish(current_app.response_class(body))
+
+    rows, next_after = storage.get_transactions_page(conn, date, after, current_app.config["SUMMARY_PAGE_SIZE"])
+    total_price, total_gas = storage.get_day_totals(conn, date)
+    chunks = stream_template("daily_summary.html", rows=rows, date=date, total_price=total_price,
+                             total_gas=total_gas, is_today=is_today, after=after, next_after=next_after)
+    return finish(current_app.response_class(_tee(chunks, lambda body: cache.put(key, etag, body))))
+
 def delete_transaction(id, date):
     if date == datetime.now().strftime("%Y-%m-%d"):
-        delete_transaction_by_id(id)
+        storage.delete_transaction_by_id(storage.get_db(), id)
+        page_cache.get_page_cache().invalidate([date])
     return redirect(url_for('summary', date=date))
 
-@app.route("/today")
 def today():
     return redirect(url_for("summary", date=datetime.now().strftime("%Y-%m-%d")))
 
+
+def _build_id(app):
+    # بصمة القوالب وهذا الملف: نشر يغيّر الـ HTML يغيّر كل الـ ETag فلا يبقى 304 على صفحة قديمة
+    digest = hashlib.sha1()
+    templates = os.path.join(app.root_path, app.template_folder)
+    for path in sorted(glob.glob(os.path.join(templates, "*.html"))) + [__file__]:
+        with open(path, "rb") as stream:
+            digest.update(stream.read())
+    return digest.hexdigest()[:12]
+
+
+def create_app(config=None):
+    """Build the application; nothing touches the database until first use."""
+    app = Flask(__name__)
+    app.config.from_mapping(
+        DB_FILE=os.environ.get("DB_FILE", "database.db"),
+        SUMMARY_PAGE_SIZE=200,
+        BUILD_ID=os.environ.get("BUILD_ID") or os.environ.get("RENDER_GIT_COMMIT"),
+        BACKFILL_DAYS=int(os.environ.get("BACKFILL_DAYS", BACKFILL_DAYS)),
+        METRICS_ENABLED=os.environ.get("METRICS_ENABLED") == "1",
+        SLOW_REQUEST_MS=float(os.environ.get("SLOW_REQUEST_MS", instrumentation.SLOW_REQUEST_MS)),
+        PROFILING_ENABLED=os.environ.get("PROFILING_ENABLED") == "1",
+        PROFILE_SAMPLE_RATE=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+        PROFILE_DIR=os.environ.get("PROFILE_DIR"),
+        PROFILE_TOKEN=os.environ.get("PROFILE_TOKEN"),
+    )
+    if config:
+        app.config.update(config)
+    if not app.config["BUILD_ID"]:
+        app.config["BUILD_ID"] = _build_id(app)
+
+    storage.init_app(app)
+    pricing.init_app(app)
+    writer.init_app(app)
+    page_cache.init_app(app)
+    reports.init_app(app)
+    instrumentation.init_app(app)
+    app.cli.add_command(bulk.import_command)
+    app.cli.add_command(bulk.export_command)
+
+    app.add_url_rule("/", view_func=index, methods=["GET", "POST"])
+    app.add_url_rule("/api/transactions", view_func=create_transactions, methods=["POST"])
+    app.add_url_rule("/api/quote", view_func=quote, methods=["POST"])
+    app.add_url_rule("/api/writer/stats", view_func=writer_stats)
+    app.add_url_rule("/api/reports", view_func=report)
+    app.add_url_rule("/api/reports/yoy", view_func=report_year_over_year)
+    app.add_url_rule("/summary/<date>", view_func=summary)
+    app.add_url_rule("/delete/<id>/<date>", view_func=delete_transaction, methods=["POST"])
+    app.add_url_rule("/today", view_func=today)
+    return app
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    create_app().run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,270 @@
+"""Load-test the main pages against a synthetic database.
+
+    python benchmark.py --rows 1000000 --requests 2000 --concurrency 16
+    python benchmark.py --json results.json
+    python benchmark.py --baseline results.json --max-regression 0.2
+
+Without ``--url`` a temporary database of ``--rows`` sales is built and
+served in-process by a threaded WSGI server.  To measure a production
+setup, build the database with ``--db FILE --prepare-only``, start
+``DB_FILE=FILE gunicorn -c gunicorn.conf.py wsgi:app`` and pass
+``--url http://127.0.0.1:5000 --db FILE``.  An existing ``--db`` file is
+reused as it is; the ``delete`` scenario only deletes rows that the
+database really holds for today.
+
+Every scenario reports p50/p99 latency and throughput.  With
+``--baseline`` the run fails when a p99 grows, or a throughput shrinks,
+by more than ``--max-regression`` compared to the saved results.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import pricing
+import storage
+
+INSERT_BATCH = 50000
+# index_post و delete يغيّران عدد الصفوف قليلا في كل تشغيل على نفس القاعدة
+ROWS_TOLERANCE = 0.01
+
+
+def build_database(path, rows, days, today_rows, seed):
+    """Fill ``path`` with ``rows`` random sales spread over ``days`` days.
+
+    ``today_rows`` of them are dated today so that ``/delete`` has work.
+    """
+    storage.init_db(path)
+    conn = storage.connect(path)
+    book = pricing.load_price_book(conn)
+    rng = np.random.default_rng(seed)
+    now = datetime.now().replace(microsecond=0)
+    try:
+        for offset in range(0, rows, INSERT_BATCH):
+            count = min(INSERT_BATCH, rows - offset)
+            types = rng.integers(0, 3, count)
+            quantities = rng.integers(0, 6, (3, count))
+            seconds = rng.integers(1, days * 86400, count)
+            stamps = [(now - timedelta(seconds=int(s))).strftime("%Y-%m-%d %H:%M:%S") for s in seconds]
+            first_today = max(0, today_rows - offset)
+            for i in range(min(count, first_today)):
+                stamps[i] = now.strftime("%Y-%m-%d 00:00:00")
+            prices, gas = book.quote_batch(types, *quantities, dates=np.array(stamps))
+            ids = [f"bench-{offset + i}" for i in range(count)]
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    zip(ids, stamps, types.tolist(), *(q.tolist() for q in quantities),
+                        prices.tolist(), gas.tolist()))
+    finally:
+        conn.close()
+
+
+def select_today_ids(path, limit):
+    """Return up to ``limit`` ids of the rows ``path`` holds for today."""
+    start, end = storage.day_range(datetime.now().strftime(storage.DATE_FORMAT))
+    conn = storage.connect(path)
+    try:
+        return [row[0] for row in conn.execute("""
+            SELECT id FROM transactions
+            WHERE datetime >= ? AND datetime < ?
+            ORDER BY datetime, id
+            LIMIT ?
+        """, (start, end, limit))]
+    finally:
+        conn.close()
+
+
+def count_rows(path):
+    conn = storage.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def start_server(db_file):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from app import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, create_app({"DB_FILE": db_file}),
+                         threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def scenarios(days, today_ids, seed):
+    rng = np.random.default_rng(seed)
+    today = datetime.now().strftime("%Y-%m-%d")
+    past_days = [(datetime.now() - timedelta(days=int(d))).strftime("%Y-%m-%d")
+                 for d in rng.integers(1, max(days, 2), 1000)]
+    form = urlencode({"customer_type": 1, "large_qty": 2, "medium_qty": 1, "small_qty": 0})
+    delete_ids = iter(today_ids)
+
+    def delete_request(i):
+        transaction_id = next(delete_ids, "missing")
+        return "POST", f"/delete/{transaction_id}/{today}", None
+
+    return {
+        "index_get": lambda i: ("GET", "/", None),
+        "index_post": lambda i: ("POST", "/", form),
+        "summary_today": lambda i: ("GET", f"/summary/{today}", None),
+        "summary_past": lambda i: ("GET", f"/summary/{past_days[i % len(past_days)]}", None),
+        "delete": delete_request,
+    }
+
+
+def run_scenario(base_url, make_request, requests, concurrency):
+    parts = urlsplit(base_url)
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, errors = [], 0
+
+    def one(i):
+        nonlocal errors
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        method, path, body = make_request(i)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        started = time.perf_counter()
+        try:
+            local.conn.request(method, path, body=body, headers=headers)
+            response = local.conn.getresponse()
+            response.read()
+            failed = response.status >= 400
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "throughput_rps": requests / wall,
+    }
+
+
+def workload_differences(report, baseline):
+    """Say why ``report`` and ``baseline`` did not measure the same workload."""
+    differences = [f"{key}: baseline {baseline.get(key)}, now {report[key]}"
+                   for key in ("requests", "concurrency") if baseline.get(key) != report[key]]
+    rows = baseline.get("rows")
+    if not rows or abs(report["rows"] - rows) > rows * ROWS_TOLERANCE:
+        differences.append(f"rows: baseline {rows}, now {report['rows']}")
+    return differences
+
+
+def compare(results, baseline, max_regression):
+    failures = []
+    for name, result in results.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if result["p99_ms"] > before["p99_ms"] * (1 + max_regression):
+            failures.append(f"{name}: p99 {before['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - max_regression):
+            failures.append(f"{name}: throughput {before['throughput_rps']:.0f} -> {result['throughput_rps']:.0f} req/s")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="synthetic sales in the database")
+    parser.add_argument("--days", type=int, default=365, help="days the sales are spread over")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="database file to build or reuse (default: a temporary file)")
+    parser.add_argument("--prepare-only", action="store_true", help="build --db and exit")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process one")
+    parser.add_argument("--only", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.TemporaryDirectory()
+    db_file = args.db or os.path.join(workdir.name, "bench.db")
+    today_rows = args.requests if args.only is None or "delete" in args.only else 0
+    if args.db and os.path.exists(args.db):
+        # قاعدة موجودة تُستعمل كما هي: إعادة بنائها لا تضيف شيئا بسبب INSERT OR IGNORE
+        storage.init_db(db_file)
+        print(f"database: reusing {db_file} ({count_rows(db_file)} rows)")
+    else:
+        started = time.perf_counter()
+        build_database(db_file, args.rows, args.days, today_rows, args.seed)
+        print(f"database: {args.rows} rows in {time.perf_counter() - started:.1f}s ({db_file})")
+    if args.prepare_only:
+        return 0
+    rows = count_rows(db_file)
+    today_ids = select_today_ids(db_file, today_rows)
+    if len(today_ids) < today_rows:
+        print(f"note: only {len(today_ids)} rows dated today, the rest of 'delete' deletes nothing")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_server(db_file)
+    try:
+        results = {}
+        for name, make_request in scenarios(args.days, today_ids, args.seed).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_scenario(base_url, make_request, args.requests, args.concurrency)
+            r = results[name]
+            print(f"{name:15} p50={r['p50_ms']:8.2f}ms p99={r['p99_ms']:8.2f}ms "
+                  f"{r['throughput_rps']:8.0f} req/s errors={r['errors']}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {"rows": rows, "requests": args.requests, "concurrency": args.concurrency,
+              "scenarios": results}
+    if args.json:
+        with open(args.json, "w") as stream:
+            json.dump(report, stream, indent=2)
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        differences = workload_differences(report, baseline)
+        for difference in differences:
+            print(f"NOT COMPARABLE {difference}")
+        if differences:
+            return 2
+        failures = compare(results, baseline, args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+from collections import namedtuple
+from datetime import datetime
+import csv
+import json
+import os
+import sqlite3
+
+import click
+import numpy as np
+
+import pricing
+import storage
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 50
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+PRICE_TOLERANCE = 0.01
+GAS_TOLERANCE = 1e-6
+
+# يتجاهل تكرار id فقط؛ مخالفة CHECK أو NOT NULL تبقى خطأ ولا تُحسب مكررا
+_INSERT = """
+    INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+ImportResult = namedtuple("ImportResult", "read inserted duplicates invalid errors kept warnings")
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def _parse_datetime(value):
+    # fromisoformat هو أسرع بكثير من strptime على ملايين الأسطر
+    value = value.strip()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidRow(f"bad datetime {value!r}")
+    # الأوقات المخزنة بتوقيت المحل بلا منطقة زمنية؛ لا نخمّن كيف نحوّل الإزاحة
+    if parsed.tzinfo is not None:
+        raise InvalidRow(f"datetime {value!r} must not carry a UTC offset")
+    return parsed.strftime(DATETIME_FORMAT)
+
+
+def parse_int(record, field):
+    """Return ``record[field]`` as a non-negative int or raise ``InvalidRow``.
+
+    JSON booleans and fractional numbers are rejected rather than truncated.
+    """
+    value = record.get(field)
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise InvalidRow(f"bad {field} {value!r}")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"bad {field} {value!r}")
+    if value < 0:
+        raise InvalidRow(f"negative {field}")
+    return value
+
+
+def _parse_total(record, field):
+    value = record.get(field)
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"bad {field} {value!r}")
+
+
+def parse_record(record):
+    """Check one CSV/JSONL record and return its fields as a tuple.
+
+    The tuple is ``(id, datetime, customer_type, large_qty, medium_qty,
+    small_qty, total_price, total_gas)`` where the totals are the ones
+    given in the record, or ``None``.  Pricing happens in ``price_records``.
+    """
+    transaction_id = str(record.get("id") or "").strip()
+    if not transaction_id:
+        raise InvalidRow("missing id")
+    return (
+        transaction_id,
+        _parse_datetime(str(record.get("datetime") or "")),
+        parse_int(record, "customer_type"),
+        parse_int(record, "large_qty"),
+        parse_int(record, "medium_qty"),
+        parse_int(record, "small_qty"),
+        _parse_total(record, "total_price"),
+        _parse_total(record, "total_gas"),
+    )
+
+
+def price_records(book, parsed, recompute=False, keep_totals=False):
+    """Price parsed records with one ``quote_batch`` call.
+
+    Totals are checked against the price table in force on each sale's
+    day.  Missing totals are filled in.  Mismatching totals are errors by
+    default; with ``recompute`` they are replaced by the computed ones and
+    with ``keep_totals`` they are stored as given and reported as warnings.
+
+    Returns ``(rows, errors, warnings)``: ``transactions`` row tuples for
+    the accepted records and ``(position, message)`` pairs for the others.
+    """
+    if not parsed:
+        return [], [], []
+    ids, when, types, large, medium, small, given_price, given_gas = zip(*parsed)
+    prices, gas = book.quote_batch(types, large, medium, small, dates=np.array(when))
+
+    unpriced = np.isnan(prices)
+    mismatched = np.zeros(len(parsed), dtype=bool)
+    if not recompute:
+        given_price = np.array(given_price, dtype=np.float64)
+        given_gas = np.array(given_gas, dtype=np.float64)
+        mismatched |= ~np.isnan(given_price) & (np.abs(given_price - prices) > PRICE_TOLERANCE)
+        mismatched |= ~np.isnan(given_gas) & (np.abs(given_gas - gas) > GAS_TOLERANCE)
+        mismatched &= ~unpriced
+    bad = unpriced if keep_totals else unpriced | mismatched
+
+    def mismatch(position):
+        return (f"totals {given_price[position]}/{given_gas[position]} "
+                f"!= {prices[position]}/{gas[position]}")
+
+    errors = []
+    for position in np.flatnonzero(bad).tolist():
+        if unpriced[position]:
+            errors.append((position, f"no price for customer_type {types[position]} on {when[position][:10]}"))
+        else:
+            errors.append((position, mismatch(position)))
+    warnings = []
+    if keep_totals:
+        warnings = [(position, "kept " + mismatch(position)) for position in np.flatnonzero(mismatched).tolist()]
+        prices = np.where(mismatched & ~np.isnan(given_price), given_price, prices)
+        gas = np.where(mismatched & ~np.isnan(given_gas), given_gas, gas)
+
+    prices, gas = prices.tolist(), gas.tolist()
+    rows = [
+        (ids[i], when[i], types[i], large[i], medium[i], small[i], prices[i], gas[i])
+        for i in np.flatnonzero(~bad).tolist()
+    ]
+    return rows, errors, warnings
+
+
+def read_records(stream, fmt):
+    """Yield ``(line_number, record)`` pairs from a CSV or JSONL stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield line_number, exc
+    else:
+        raise ValueError(f"unsupported format {fmt!r}")
+
+
+def import_stream(conn, stream, fmt, batch_size=BATCH_SIZE, recompute=False,
+                  keep_totals=False, book=None):
+    """Stream records into ``transactions`` in chunked transactions.
+
+    Rows whose ``id`` already exists are skipped, so re-running an import
+    is harmless.  Invalid rows are counted and the first few reported, as
+    are rows kept with mismatching totals under ``keep_totals``.
+    """
+    book = book or pricing.load_price_book(conn)
+    read = inserted = invalid = kept = 0
+    errors, warnings = [], []
+    line_numbers, batch = [], []
+
+    def reject(line_number, message):
+        nonlocal invalid
+        invalid += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((line_number, message))
+
+    def flush():
+        nonlocal inserted, kept
+        rows, rejected, mismatched = price_records(book, batch, recompute, keep_totals)
+        for position, message in rejected:
+            reject(line_numbers[position], message)
+        kept += len(mismatched)
+        for position, message in mismatched[:MAX_REPORTED_ERRORS - len(warnings)]:
+            warnings.append((line_numbers[position], message))
+        try:
+            with conn:
+                inserted += conn.executemany(_INSERT, rows).rowcount
+        except sqlite3.IntegrityError:
+            # صف يخالف قيود الجدول: نعيد الدفعة صفا صفا لنعرف أيها
+            rejected = {position for position, _ in rejected}
+            accepted = [p for p in range(len(batch)) if p not in rejected]
+            for position, row in zip(accepted, rows):
+                try:
+                    with conn:
+                        inserted += conn.execute(_INSERT, row).rowcount
+                except sqlite3.IntegrityError as exc:
+                    reject(line_numbers[position], str(exc))
+        line_numbers.clear()
+        batch.clear()
+
+    for line_number, record in read_records(stream, fmt):
+        read += 1
+        try:
+            if isinstance(record, Exception) or not isinstance(record, dict):
+                raise InvalidRow(f"unreadable record: {record}")
+            batch.append(parse_record(record))
+        except InvalidRow as exc:
+            reject(line_number, str(exc))
+            continue
+        line_numbers.append(line_number)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    duplicates = read - invalid - inserted
+    return ImportResult(read, inserted, duplicates, invalid, errors, kept, warnings)
+
+
+def export_range(conn, start, end, stream):
+    """Write transactions with ``start <= datetime < end`` as CSV.
+
+    Rows are streamed from the cursor, never collected in memory.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(storage.COLUMNS)
+    cur = conn.execute("""
+        SELECT * FROM transactions
+        WHERE datetime >= ? AND datetime < ?
+        ORDER BY datetime, id
+    """, (start, end))
+    cur.arraysize = BATCH_SIZE
+    count = 0
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            return count
+        writer.writerows(rows)
+        count += len(rows)
+
+
+def _guess_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return "jsonl" if extension in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+@click.command("import-transactions")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Defaults to the file extension.")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+@click.option("--recompute", is_flag=True, help="Replace mismatching totals with the computed ones.")
+@click.option("--keep-totals", is_flag=True, help="Store mismatching totals as given and print a warning for each.")
+def import_command(paths, fmt, batch_size, recompute, keep_totals):
+    """Load CSV or JSONL sales files into the database.
+
+    Given totals are checked against the price table in force on each
+    sale's day, and by default a row whose totals disagree is rejected.
+    The totals in the bundled transactions.csv do not match the price
+    table, so that file only loads with --recompute or --keep-totals.
+    """
+    if recompute and keep_totals:
+        raise click.UsageError("--recompute and --keep-totals are mutually exclusive")
+    conn = storage.get_db()
+    failed = False
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as stream:
+            result = import_stream(conn, stream, fmt or _guess_format(path),
+                                   batch_size=batch_size, recompute=recompute,
+                                   keep_totals=keep_totals, book=pricing.get_price_book())
+        click.echo(f"{path}: read={result.read} inserted={result.inserted} "
+                   f"duplicates={result.duplicates} invalid={result.invalid} kept={result.kept}")
+        for line_number, message in result.errors:
+            click.echo(f"  line {line_number}: {message}", err=True)
+        for line_number, message in result.warnings:
+            click.echo(f"  line {line_number}: warning: {message}", err=True)
+        failed = failed or result.invalid > 0
+    if failed:
+        raise click.ClickException("some rows were rejected")
+
+
+@click.command("export-transactions")
+@click.option("--start", required=True, help="First day, YYYY-MM-DD.")
+@click.option("--end", required=True, help="Day after the last exported day, YYYY-MM-DD.")
+@click.option("--output", type=click.File("w", encoding="utf-8", lazy=False), default="-")
+def export_command(start, end, output):
+    """Write a date range of transactions to CSV."""
+    try:
+        start, _ = storage.day_range(start)
+        end, _ = storage.day_range(end)
+    except ValueError:
+        raise click.BadParameter("dates must be YYYY-MM-DD")
+    count = export_range(storage.get_db(), start, end, output)
+    click.echo(f"exported {count} rows", err=True)
@@ -0,0 +1,26 @@
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# كل عامل يحمّل pandas و numpy وخيط كتابة خاصا به (80 ميغا على الأقل)، لذلك العدد
+# ثابت وصغير ليناسب خطة 512 ميغا؛ على خادم أكبر ارفع WEB_CONCURRENCY (مثلا
+# 2 × عدد الأنوية + 1) ما دامت الذاكرة تكفي، أو GUNICORN_THREADS لمزيد من التوازي
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = "-"
+
+# كل عامل يبني التطبيق بنفسه بعد fork، فلا يرث اتصالات أو خيوطا من الأب
+preload_app = False
+
+
+def on_starting(server):
+    # الهجرات تُطبَّق مرة واحدة قبل تشغيل العمال
+    import storage
+
+    storage.init_db(os.environ.get("DB_FILE", "database.db"))
@@ -0,0 +1,253 @@
+"""Optional request, SQL, template and hot-path metrics.
+
+Nothing here is wired in unless ``METRICS_ENABLED`` is set: with it off
+the only cost left on the hot path is the ``span()`` check for a module
+flag.  With it on, ``/metrics`` serves Prometheus text for the current
+process (each gunicorn worker reports its own numbers), slow requests
+are logged, and ``PROFILING_ENABLED`` allows cProfile runs on sampled
+requests or on requests whose ``X-Profile-Token`` header matches the
+``PROFILE_TOKEN`` setting (forcing a profile is off when it is unset).
+"""
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import sqlite3
+import threading
+import time
+
+from flask import before_render_template, current_app, g, has_app_context, request, template_rendered
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SLOW_REQUEST_MS = 500
+PROFILE_TOP = 30
+
+_enabled = False
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [0] * (len(buckets) + 2))
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {values[-1]}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("gas_http_request_duration_seconds",
+                            "Request latency by route.", ("endpoint", "method", "status"))
+REQUEST_QUERIES = Histogram("gas_http_request_sql_queries",
+                            "SQL statements executed per request.", ("endpoint",), COUNT_BUCKETS)
+SQL_SECONDS = Histogram("gas_sql_query_duration_seconds",
+                        "SQL statement execution time up to the first row.", ("statement",))
+RENDER_SECONDS = Histogram("gas_template_render_duration_seconds",
+                           "Template rendering time.", ("template",))
+SPAN_SECONDS = Histogram("gas_span_duration_seconds",
+                         "Time spent in instrumented code paths.", ("span",))
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_QUERIES, SQL_SECONDS, RENDER_SECONDS, SPAN_SECONDS)
+
+
+def _record_query(sql, elapsed):
+    statement = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else "empty"
+    SQL_SECONDS.observe((statement,), elapsed)
+    if has_app_context():
+        g.sql_queries = g.get("sql_queries", 0) + 1
+        g.sql_seconds = g.get("sql_seconds", 0.0) + elapsed
+
+
+class TimedConnection(sqlite3.Connection):
+    """``sqlite3.Connection`` that reports every statement it runs."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_query("commit", time.perf_counter() - started)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            _record_query("script", time.perf_counter() - started)
+
+
+@contextmanager
+def _timed_span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe((name,), time.perf_counter() - started)
+
+
+def span(name):
+    """Time a block under ``name``; a shared no-op when metrics are off."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _timed_span(name)
+
+
+def _profile_requested(token):
+    # كل ملف .prof يُكتب على القرص، فلا يطلبه إلا من يعرف الرمز
+    given = request.headers.get("X-Profile-Token")
+    return bool(token and given) and hmac.compare_digest(given.encode(), token.encode())
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    config = current_app.config
+    if config["PROFILING_ENABLED"] and (
+            _profile_requested(config["PROFILE_TOKEN"])
+            or random.random() < config["PROFILE_SAMPLE_RATE"]):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+    endpoint = request.endpoint or "unmatched"
+    status = g.get("response_status", 500 if exc else 200)
+    queries = g.get("sql_queries", 0)
+    REQUEST_SECONDS.observe((endpoint, request.method, status), elapsed)
+    REQUEST_QUERIES.observe((endpoint,), queries)
+
+    if elapsed * 1000 >= current_app.config["SLOW_REQUEST_MS"]:
+        current_app.logger.warning(
+            "slow request %s %s -> %s in %.1f ms (sql %d queries, %.1f ms; render %.1f ms)",
+            request.method, request.full_path.rstrip("?"), status, elapsed * 1000,
+            queries, g.get("sql_seconds", 0.0) * 1000, g.get("render_seconds", 0.0) * 1000)
+    if profiler is not None:
+        _report_profile(profiler, endpoint)
+
+
+def _report_profile(profiler, endpoint):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    current_app.logger.info("profile of %s %s\n%s", request.method, request.full_path.rstrip("?"), stream.getvalue())
+    directory = current_app.config["PROFILE_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault("render_started", []).append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    stack = g.get("render_started")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    g.render_seconds = g.get("render_seconds", 0.0) + elapsed
+    RENDER_SECONDS.observe((template.name or "string",), elapsed)
+
+
+def render_metrics(app):
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+
+    stats = app.extensions["writer"].stats()
+    for key, kind in (("batches", "counter"), ("rows", "counter"), ("submissions", "counter"),
+                      ("failed_batches", "counter"), ("commit_seconds", "counter"),
+                      ("queue_depth", "gauge"), ("max_queue_depth", "gauge"),
+                      ("last_batch_rows", "gauge"), ("max_batch_rows", "gauge")):
+        suffix = "_total" if kind == "counter" else ""
+        name = f"gas_writer_{key}{suffix}"
+        lines += [f"# TYPE {name} {kind}", f"{name} {stats[key]}"]
+
+    cache = app.extensions["page_cache"]
+    lines += ["# TYPE gas_summary_cache_hits_total counter", f"gas_summary_cache_hits_total {cache.hits}",
+              "# TYPE gas_summary_cache_misses_total counter", f"gas_summary_cache_misses_total {cache.misses}"]
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    global _enabled
+    app.config.setdefault("METRICS_ENABLED", False)
+    app.config.setdefault("SLOW_REQUEST_MS", SLOW_REQUEST_MS)
+    app.config.setdefault("PROFILING_ENABLED", False)
+    app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+    app.config.setdefault("PROFILE_DIR", None)
+    app.config.setdefault("PROFILE_TOKEN", None)
+    if not app.config["METRICS_ENABLED"]:
+        return
+    _enabled = True
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_template_rendered, app)
+
+    app.extensions["storage"].factory = TimedConnection
+    app.extensions["writer"].factory = TimedConnection
+    app.add_url_rule("/metrics", "metrics", lambda: app.response_class(
+        render_metrics(app), mimetype="text/plain; version=0.0.4"))
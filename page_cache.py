@@ -0,0 +1,56 @@
+from collections import OrderedDict
+import threading
+
+from flask import current_app
+
+MAX_ENTRIES = 256
+
+
+class PageCache:
+    """A small LRU of rendered pages keyed by ``(date, ...)`` tuples.
+
+    Each entry keeps the ETag it was rendered for, so a stale entry is
+    never served even if an invalidation was missed (for example when the
+    change came from another worker process): ``get`` only returns a body
+    whose ETag matches the current one.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, etag, body):
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dates):
+        dates = set(dates)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in dates]:
+                del self._entries[key]
+
+
+def init_app(app):
+    app.config.setdefault("SUMMARY_CACHE_SIZE", MAX_ENTRIES)
+    cache = PageCache(app.config["SUMMARY_CACHE_SIZE"])
+    app.extensions["page_cache"] = cache
+    app.extensions["writer"].listeners.append(cache.invalidate)
+
+
+def get_page_cache():
+    return current_app.extensions["page_cache"]
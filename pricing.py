@@ -0,0 +1,256 @@
+from bisect import bisect_right
+from datetime import datetime
+import threading
+import time
+
+import click
+import numpy as np
+from flask import current_app
+
+import storage
+
+# وزن الغاز (كغ) في كل قنينة؛ الأسعار في جدول price_tables (الهجرة 4 و flask prices set)
+WEIGHTS = {'large': 12, 'medium': 6, 'small': 2.7}
+
+SIZES = ('large', 'medium', 'small')
+CACHE_CHECK_INTERVAL = 5
+REPRICE_CHUNK = 50000
+
+_WEIGHT_VECTOR = np.array([WEIGHTS[size] for size in SIZES], dtype=np.float64)
+
+
+class PriceBook:
+    """Every price table version, compiled for scalar and array lookups.
+
+    ``versions`` holds ``(effective_date, {customer_type: prices})`` pairs
+    sorted by date, each already merged with the versions before it, so
+    a lookup is a single bisect.  The same data is kept as a
+    ``(versions, customer types, sizes)`` array for ``quote_batch``.
+    """
+
+    def __init__(self, rows, signature=None):
+        self.signature = signature
+        self.versions = []
+        current = {}
+        for effective_date, customer_type, large, medium, small in sorted(rows):
+            if self.versions and self.versions[-1][0] == effective_date:
+                self.versions.pop()
+            current = dict(current)
+            current[customer_type] = {'large': large, 'medium': medium, 'small': small}
+            self.versions.append((effective_date, current))
+        self.dates = [effective_date for effective_date, _ in self.versions]
+        self.customer_types = sorted(current)
+
+        # customer_type -> عمود في المصفوفة، و -1 للأنواع غير المعروفة
+        size = max(self.customer_types, default=-1) + 1
+        self._type_column = np.full(max(size, 1), -1, dtype=np.int64)
+        self._type_column[self.customer_types] = np.arange(len(self.customer_types))
+        self._table = np.full((len(self.versions), len(self.customer_types), len(SIZES)), np.nan)
+        for v, (_, prices) in enumerate(self.versions):
+            for customer_type, table in prices.items():
+                self._table[v, self._type_column[customer_type]] = [table[s] for s in SIZES]
+        self._dates = np.array(self.dates, dtype="datetime64[D]")
+
+    def prices_on(self, date=None):
+        """Return the ``{customer_type: prices}`` table in force on ``date``."""
+        date = (date or datetime.now().strftime(storage.DATE_FORMAT))[:10]
+        index = bisect_right(self.dates, date) - 1
+        return self.versions[index][1] if index >= 0 else {}
+
+    def quote(self, customer_type, large_qty, medium_qty, small_qty, date=None):
+        """Return ``(total_price, total_gas)`` for one sale; gas is in tonnes.
+
+        Raises ``KeyError`` when ``customer_type`` has no price on ``date``.
+        """
+        price_table = self.prices_on(date)[customer_type]
+        total_price = large_qty * price_table['large'] + medium_qty * price_table['medium'] + small_qty * price_table['small']
+        total_gas = (large_qty * WEIGHTS['large'] + medium_qty * WEIGHTS['medium'] + small_qty * WEIGHTS['small']) / 1000
+        return total_price, total_gas
+
+    def quote_batch(self, customer_types, large_qty, medium_qty, small_qty, dates=None):
+        """Price many sales at once.
+
+        ``dates`` may be one date for every sale, an array of
+        ``YYYY-MM-DD[ HH:MM:SS]`` strings or ``datetime64`` values, or
+        ``None`` for today.  Returns ``(total_price, total_gas)`` float
+        arrays; prices are NaN where the customer type had no price on
+        that date.
+        """
+        types = np.asarray(customer_types, dtype=np.int64)
+        quantities = np.column_stack((large_qty, medium_qty, small_qty)).astype(np.float64)
+        total_gas = quantities @ _WEIGHT_VECTOR / 1000
+
+        if dates is None:
+            dates = datetime.now().strftime(storage.DATE_FORMAT)
+        dates = np.asarray(dates)
+        if dates.dtype.kind == "U":
+            dates = dates.astype("U10")
+        versions = np.searchsorted(self._dates, dates.astype("datetime64[D]"), side="right") - 1
+        versions = np.broadcast_to(versions, types.shape)
+
+        known = (types >= 0) & (types < len(self._type_column))
+        columns = np.where(known, self._type_column[np.where(known, types, 0)], -1)
+        valid = (columns >= 0) & (versions >= 0)
+        total_price = np.full(types.shape, np.nan)
+        if valid.any() and len(self.versions):
+            unit = self._table[versions[valid], columns[valid]]
+            total_price[valid] = np.einsum("ij,ij->i", unit, quantities[valid])
+        return total_price, total_gas
+
+
+def load_price_book(conn):
+    rows = conn.execute("""
+        SELECT effective_date, customer_type, large, medium, small
+        FROM price_tables
+    """).fetchall()
+    return PriceBook(rows, signature=_signature(conn))
+
+
+def _signature(conn):
+    # REPLACE يغيّر rowid، لذلك يكفي هذا لمعرفة أي تعديل
+    return conn.execute("SELECT COUNT(*), MAX(rowid) FROM price_tables").fetchone()
+
+
+class PriceCache:
+    """Keep the compiled ``PriceBook`` in memory.
+
+    The book is reloaded after ``invalidate()`` and whenever a cheap check,
+    done at most every ``check_interval`` seconds, shows that another
+    process changed ``price_tables``.
+    """
+
+    def __init__(self, check_interval=CACHE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._book = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, conn):
+        now = time.monotonic()
+        book = self._book
+        if book is not None and now - self._checked < self.check_interval:
+            return book
+        with self._lock:
+            if self._book is None or _signature(conn) != self._book.signature:
+                self._book = load_price_book(conn)
+            self._checked = now
+            return self._book
+
+    def invalidate(self):
+        with self._lock:
+            self._book = None
+
+
+def set_prices(conn, effective_date, customer_type, large, medium, small):
+    """Store the prices of ``customer_type`` from ``effective_date`` on.
+
+    Raises ``ValueError`` for a malformed date, a negative customer type
+    (``PriceBook`` indexes its columns by type) or a negative price.
+    """
+    try:
+        effective_date, _ = storage.day_range(effective_date)
+    except (TypeError, ValueError):
+        raise ValueError("effective date must be YYYY-MM-DD")
+    if customer_type < 0:
+        raise ValueError("customer type must not be negative")
+    if min(large, medium, small) < 0:
+        raise ValueError("prices must not be negative")
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO price_tables
+                (effective_date, customer_type, large, medium, small)
+            VALUES (?, ?, ?, ?, ?)
+        """, (effective_date, customer_type, large, medium, small))
+
+
+def reprice_range(conn, start, end, book, date=None):
+    """Re-price the transactions in ``[start, end)`` without changing them.
+
+    With ``date`` set every sale is priced with the table in force on that
+    day, otherwise with the table in force on its own day.  Rows are read
+    in columnar chunks and priced with ``quote_batch``.
+    """
+    cur = conn.execute("""
+        SELECT datetime, customer_type, large_qty, medium_qty, small_qty, total_price
+        FROM transactions
+        WHERE datetime >= ? AND datetime < ?
+    """, (start, end))
+    cur.arraysize = REPRICE_CHUNK
+    result = {"rows": 0, "unpriced": 0, "stored_total": 0.0, "repriced_total": 0.0}
+    while True:
+        chunk = cur.fetchmany()
+        if not chunk:
+            break
+        when, types, large, medium, small, stored = zip(*chunk)
+        prices, _ = book.quote_batch(types, large, medium, small,
+                                     dates=date if date else np.array(when))
+        missing = np.isnan(prices)
+        result["rows"] += len(chunk)
+        result["unpriced"] += int(missing.sum())
+        result["stored_total"] += float(np.nansum(np.asarray(stored, dtype=np.float64)))
+        result["repriced_total"] += float(prices[~missing].sum())
+    result["delta"] = result["repriced_total"] - result["stored_total"]
+    return result
+
+
+def init_app(app):
+    app.config.setdefault("PRICE_CACHE_CHECK_INTERVAL", CACHE_CHECK_INTERVAL)
+    app.extensions["pricing"] = PriceCache(app.config["PRICE_CACHE_CHECK_INTERVAL"])
+    app.cli.add_command(prices_cli)
+
+
+def get_price_book():
+    return current_app.extensions["pricing"].get(storage.get_db())
+
+
+def invalidate():
+    current_app.extensions["pricing"].invalidate()
+
+
+@click.group("prices")
+def prices_cli():
+    """Manage versioned price tables."""
+
+
+@prices_cli.command("show")
+@click.option("--date", help="Show the table in force on this day, YYYY-MM-DD.")
+def show_command(date):
+    """List price table versions."""
+    book = get_price_book()
+    versions = [(date, book.prices_on(date))] if date else book.versions
+    for effective_date, prices in versions:
+        click.echo(effective_date)
+        for customer_type, table in sorted(prices.items()):
+            click.echo(f"  type={customer_type} " + " ".join(f"{s}={table[s]}" for s in SIZES))
+
+
+@prices_cli.command("set")
+@click.argument("effective_date")
+@click.argument("customer_type", type=int)
+@click.argument("large", type=float)
+@click.argument("medium", type=float)
+@click.argument("small", type=float)
+def set_command(effective_date, customer_type, large, medium, small):
+    """Set the prices of CUSTOMER_TYPE from EFFECTIVE_DATE on."""
+    try:
+        set_prices(storage.get_db(), effective_date, customer_type, large, medium, small)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+    invalidate()
+    click.echo(f"type={customer_type} prices from {effective_date} saved")
+
+
+@prices_cli.command("what-if")
+@click.option("--start", required=True, help="First day, YYYY-MM-DD.")
+@click.option("--end", required=True, help="Day after the last day, YYYY-MM-DD.")
+@click.option("--date", help="Price every sale with the table in force on this day.")
+def what_if_command(start, end, date):
+    """Compare stored totals with a re-pricing of a date range."""
+    try:
+        for day in (start, end) + ((date,) if date else ()):
+            storage.day_range(day)
+    except ValueError:
+        raise click.BadParameter("dates must be YYYY-MM-DD")
+    result = reprice_range(storage.get_db(), start, end, get_price_book(), date=date)
+    for key, value in result.items():
+        click.echo(f"{key}: {value}")
@@ -0,0 +1,238 @@
+from datetime import date as date_type
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+import storage
+
+SNAPSHOT_DIR = "snapshots"
+CHUNK_SIZE = 10000
+
+PERIODS = {"day": "D", "week": "W", "month": "M", "year": "Y"}
+# مفتاح المقارنة بين سنتين لكل نوع من الفترات؛ الأسابيع حسب ISO 8601
+YOY_SLOTS = {"day": "%m-%d", "week": "W%V", "month": "%m"}
+
+# حدود التقارير: لا شيء قبل 1970 ولا بعد سنة من اليوم، ولا أكثر من عشر سنوات دفعة واحدة
+MIN_DATE = "1970-01-01"
+MAX_FUTURE_DAYS = 366
+MAX_SPAN_DAYS = 3660
+QTY_COLUMNS = ["large_qty", "medium_qty", "small_qty"]
+VALUE_COLUMNS = ["tx_count", "total_price", "total_gas"] + QTY_COLUMNS
+
+_DTYPES = {
+    "customer_type": np.int64,
+    "tx_count": np.int64,
+    "total_price": np.float64,
+    "total_gas": np.float64,
+    "large_qty": np.int64,
+    "medium_qty": np.int64,
+    "small_qty": np.int64,
+}
+
+_DAYS_QUERY = """
+    SELECT day, customer_type, tx_count, total_price, total_gas,
+           large_qty, medium_qty, small_qty
+    FROM daily_totals
+    WHERE day >= ? AND day < ?
+    ORDER BY day, customer_type
+"""
+
+
+def _empty_frame():
+    frame = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in _DTYPES.items()})
+    frame.insert(0, "day", pd.Series(dtype="datetime64[ns]"))
+    return frame
+
+
+def read_days(conn, start, end, chunksize=CHUNK_SIZE):
+    """Read ``daily_totals`` rows for ``[start, end)`` as a columnar frame.
+
+    The rollup already holds one row per day and customer type, so reports
+    never have to scan ``transactions``.
+    """
+    chunks = [chunk.astype(_DTYPES) for chunk in
+              pd.read_sql_query(_DAYS_QUERY, conn, params=(start, end), chunksize=chunksize)]
+    if not chunks:
+        return _empty_frame()
+    frame = pd.concat(chunks, ignore_index=True)
+    frame["day"] = pd.to_datetime(frame["day"], format="%Y-%m-%d")
+    return frame
+
+
+def _month_start(value):
+    return value.replace(day=1)
+
+
+def _next_month(value):
+    return (value.replace(day=28) + pd.Timedelta(days=4)).replace(day=1)
+
+
+class SnapshotStore:
+    """Per-month ``.npz`` copies of ``daily_totals`` for closed months.
+
+    A snapshot records the sum of the ``day_changes`` versions of its
+    month.  If a late import or correction touches that month the sum no
+    longer matches and the snapshot is rebuilt on next use.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+
+    def _path(self, month):
+        return os.path.join(self.directory, f"{month:%Y-%m}.npz")
+
+    def load(self, conn, month):
+        start, end = f"{month:%Y-%m-%d}", f"{_next_month(month):%Y-%m-%d}"
+        signature = conn.execute("""
+            SELECT COALESCE(SUM(version), 0), COUNT(*)
+            FROM day_changes WHERE day >= ? AND day < ?
+        """, (start, end)).fetchone()
+        path = self._path(month)
+        try:
+            with np.load(path) as data:
+                if tuple(data["signature"]) == signature:
+                    frame = pd.DataFrame({column: data[column] for column in _DTYPES})
+                    frame.insert(0, "day", data["day"].astype("datetime64[ns]"))
+                    return frame
+        except (OSError, KeyError, ValueError):
+            pass
+        frame = read_days(conn, start, end)
+        self._save(path, frame, signature)
+        return frame
+
+    def _save(self, path, frame, signature):
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {column: frame[column].to_numpy() for column in _DTYPES}
+        arrays["day"] = frame["day"].to_numpy().astype("datetime64[D]")
+        arrays["signature"] = np.array(signature, dtype=np.int64)
+        # الكتابة في ملف مؤقت ثم rename حتى لا يقرأ عامل آخر ملفا ناقصا
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".npz")
+        with os.fdopen(fd, "wb") as stream:
+            np.savez_compressed(stream, **arrays)
+        os.replace(tmp, path)
+
+
+def check_range(start, end, today=None):
+    """Parse the ``YYYY-MM-DD`` bounds of a report and check its window.
+
+    Returns ``(start, end)`` as ``Timestamp``s.  Raises ``ValueError`` with
+    a message for the client when a bound is malformed, outside
+    ``MIN_DATE`` .. today + ``MAX_FUTURE_DAYS``, or the span is empty or
+    longer than ``MAX_SPAN_DAYS``.
+    """
+    try:
+        storage.day_range(start)
+        storage.day_range(end)
+        first, stop = pd.Timestamp(start), pd.Timestamp(end)
+    except (TypeError, ValueError):
+        # OutOfBoundsDatetime و DateParseError من pandas هي ValueError أيضا
+        raise ValueError("start and end must be YYYY-MM-DD")
+    latest = pd.Timestamp(today or date_type.today()) + pd.Timedelta(days=MAX_FUTURE_DAYS)
+    if first < pd.Timestamp(MIN_DATE) or stop > latest:
+        raise ValueError(f"start and end must be between {MIN_DATE} and {latest:%Y-%m-%d}")
+    if stop <= first:
+        raise ValueError("end must be after start")
+    if (stop - first).days > MAX_SPAN_DAYS:
+        raise ValueError(f"a report covers at most {MAX_SPAN_DAYS} days")
+    return first, stop
+
+
+def check_year(year, today=None):
+    """Raise ``ValueError`` unless ``year`` and the year before are reportable."""
+    first = pd.Timestamp(MIN_DATE).year + 1
+    last = (pd.Timestamp(today or date_type.today()) + pd.Timedelta(days=MAX_FUTURE_DAYS)).year
+    if not first <= year <= last:
+        raise ValueError(f"year must be between {first} and {last}")
+
+
+def load_range(conn, start, end, snapshots=None, today=None):
+    """Return daily rows for ``[start, end)`` as one frame.
+
+    Months that ended before the current one come from ``snapshots``
+    when given; the current month is always read from the database.
+    """
+    first, stop = pd.Timestamp(start), pd.Timestamp(end)
+    current_month = _month_start(pd.Timestamp(today or date_type.today()))
+    frames = []
+    month = _month_start(first)
+    while month < stop:
+        following = _next_month(month)
+        if snapshots is not None and following <= current_month:
+            frame = snapshots.load(conn, month)
+        else:
+            frame = read_days(conn, f"{month:%Y-%m-%d}", f"{following:%Y-%m-%d}")
+        frames.append(frame)
+        month = following
+    if not frames:
+        return _empty_frame()
+    frame = pd.concat(frames, ignore_index=True)
+    return frame[(frame["day"] >= first) & (frame["day"] < stop)]
+
+
+def aggregate(frame, period="month", by_type=False):
+    """Group daily rows by ``period`` (and customer type).
+
+    Adds the bottle mix as shares of all bottles sold and the period over
+    period change of revenue and gas, per customer type when ``by_type``.
+    """
+    keys = ["period", "customer_type"] if by_type else ["period"]
+    frame = frame.assign(period=frame["day"].dt.to_period(PERIODS[period]).dt.start_time)
+    grouped = frame.groupby(keys, sort=True)[VALUE_COLUMNS].sum().reset_index()
+
+    bottles = grouped[QTY_COLUMNS].sum(axis=1)
+    for column in QTY_COLUMNS:
+        grouped[column.replace("_qty", "_share")] = grouped[column] / bottles.where(bottles > 0)
+    if grouped.empty:
+        return grouped.assign(revenue_change=np.nan, gas_change=np.nan)
+    trend = grouped.groupby("customer_type") if by_type else grouped
+    grouped["revenue_change"] = trend["total_price"].pct_change(fill_method=None)
+    grouped["gas_change"] = trend["total_gas"].pct_change(fill_method=None)
+    return grouped
+
+
+def year_over_year(conn, year, period="month", snapshots=None):
+    """Compare ``year`` with the year before, period by period.
+
+    Weeks are ISO weeks and belong to their ISO year, so week 1 may start
+    in late December and the last week may end in early January.
+    """
+    if period == "week":
+        start, end = date_type.fromisocalendar(year - 1, 1, 1), date_type.fromisocalendar(year + 1, 1, 1)
+    else:
+        start, end = date_type(year - 1, 1, 1), date_type(year + 1, 1, 1)
+    frame = load_range(conn, f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}", snapshots)
+    grouped = aggregate(frame, period)
+    if period == "week":
+        grouped["year"] = grouped["period"].dt.isocalendar()["year"].astype(np.int64)
+    else:
+        grouped["year"] = grouped["period"].dt.year
+    grouped["slot"] = grouped["period"].dt.strftime(YOY_SLOTS[period])
+    current = grouped[grouped["year"] == year].set_index("slot")
+    previous = grouped[grouped["year"] == year - 1].set_index("slot")
+    result = current[["period", "total_price", "total_gas", "tx_count"]].join(
+        previous[["total_price", "total_gas", "tx_count"]], rsuffix="_previous", how="outer")
+    result["revenue_growth"] = result["total_price"] / result["total_price_previous"] - 1
+    result["gas_growth"] = result["total_gas"] / result["total_gas_previous"] - 1
+    return result.reset_index()
+
+
+def to_records(frame):
+    """Make a report frame JSON serialisable."""
+    frame = frame.copy()
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime(storage.DATE_FORMAT)
+    frame = frame.replace([np.inf, -np.inf], np.nan).astype(object)
+    return frame.where(frame.notna(), None).to_dict(orient="records")
+
+
+def init_app(app):
+    app.config.setdefault("SNAPSHOT_DIR", SNAPSHOT_DIR)
+    app.extensions["reports"] = SnapshotStore(app.config["SNAPSHOT_DIR"])
+
+
+def get_snapshots():
+    return current_app.extensions["reports"]
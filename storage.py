@@ -0,0 +1,489 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import queue
+import sqlite3
+import threading
+
+import click
+from flask import current_app, g
+
+DATE_FORMAT = "%Y-%m-%d"
+# الصيغة الوحيدة المقبولة في transactions.datetime (الهجرة 6)
+DATETIME_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+
+# تُبقي daily_totals محدَّثة داخل نفس المعاملة (الهجرة 3، وتُعاد في الهجرة 6)
+_ROLLUP_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_insert
+    AFTER INSERT ON transactions
+    BEGIN
+        INSERT INTO daily_totals (day, customer_type, tx_count, total_price,
+                                  total_gas, large_qty, medium_qty, small_qty)
+        VALUES (substr(NEW.datetime, 1, 10), NEW.customer_type, 1,
+                NEW.total_price, NEW.total_gas,
+                NEW.large_qty, NEW.medium_qty, NEW.small_qty)
+        ON CONFLICT (day, customer_type) DO UPDATE SET
+            tx_count = tx_count + 1,
+            total_price = total_price + excluded.total_price,
+            total_gas = total_gas + excluded.total_gas,
+            large_qty = large_qty + excluded.large_qty,
+            medium_qty = medium_qty + excluded.medium_qty,
+            small_qty = small_qty + excluded.small_qty;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_delete
+    AFTER DELETE ON transactions
+    BEGIN
+        UPDATE daily_totals SET
+            tx_count = tx_count - 1,
+            total_price = total_price - OLD.total_price,
+            total_gas = total_gas - OLD.total_gas,
+            large_qty = large_qty - OLD.large_qty,
+            medium_qty = medium_qty - OLD.medium_qty,
+            small_qty = small_qty - OLD.small_qty
+        WHERE day = substr(OLD.datetime, 1, 10)
+          AND customer_type = OLD.customer_type;
+        DELETE FROM daily_totals
+        WHERE day = substr(OLD.datetime, 1, 10)
+          AND customer_type = OLD.customer_type
+          AND tx_count <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update
+    AFTER UPDATE ON transactions
+    BEGIN
+        UPDATE daily_totals SET
+            tx_count = tx_count - 1,
+            total_price = total_price - OLD.total_price,
+            total_gas = total_gas - OLD.total_gas,
+            large_qty = large_qty - OLD.large_qty,
+            medium_qty = medium_qty - OLD.medium_qty,
+            small_qty = small_qty - OLD.small_qty
+        WHERE day = substr(OLD.datetime, 1, 10)
+          AND customer_type = OLD.customer_type;
+        DELETE FROM daily_totals
+        WHERE day = substr(OLD.datetime, 1, 10)
+          AND customer_type = OLD.customer_type
+          AND tx_count <= 0;
+        INSERT INTO daily_totals (day, customer_type, tx_count, total_price,
+                                  total_gas, large_qty, medium_qty, small_qty)
+        VALUES (substr(NEW.datetime, 1, 10), NEW.customer_type, 1,
+                NEW.total_price, NEW.total_gas,
+                NEW.large_qty, NEW.medium_qty, NEW.small_qty)
+        ON CONFLICT (day, customer_type) DO UPDATE SET
+            tx_count = tx_count + 1,
+            total_price = total_price + excluded.total_price,
+            total_gas = total_gas + excluded.total_gas,
+            large_qty = large_qty + excluded.large_qty,
+            medium_qty = medium_qty + excluded.medium_qty,
+            small_qty = small_qty + excluded.small_qty;
+    END;
+"""
+
+# ترفع إصدار اليوم مع كل تغيير (الهجرة 5، وتُعاد في الهجرة 6)
+_DAY_CHANGES_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS trg_day_changes_insert
+    AFTER INSERT ON transactions
+    BEGIN
+        INSERT INTO day_changes (day, version, updated_at)
+        VALUES (substr(NEW.datetime, 1, 10), 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (day) DO UPDATE SET
+            version = version + 1, updated_at = excluded.updated_at;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_day_changes_delete
+    AFTER DELETE ON transactions
+    BEGIN
+        INSERT INTO day_changes (day, version, updated_at)
+        VALUES (substr(OLD.datetime, 1, 10), 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (day) DO UPDATE SET
+            version = version + 1, updated_at = excluded.updated_at;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_day_changes_update
+    AFTER UPDATE ON transactions
+    BEGIN
+        INSERT INTO day_changes (day, version, updated_at)
+        VALUES (substr(OLD.datetime, 1, 10), 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (day) DO UPDATE SET
+            version = version + 1, updated_at = excluded.updated_at;
+        INSERT INTO day_changes (day, version, updated_at)
+        VALUES (substr(NEW.datetime, 1, 10), 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (day) DO UPDATE SET
+            version = version + 1, updated_at = excluded.updated_at;
+    END;
+"""
+
+# الهجرات مرتبة حسب الإصدار (PRAGMA user_version)
+MIGRATIONS = [
+    # 1: الجدول الأساسي
+    """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id TEXT PRIMARY KEY,
+        datetime TEXT,
+        customer_type INTEGER,
+        large_qty INTEGER,
+        medium_qty INTEGER,
+        small_qty INTEGER,
+        total_price REAL,
+        total_gas REAL
+    );
+    """,
+    # 2: فهرس على التاريخ لاستعلامات المدى
+    """
+    CREATE INDEX IF NOT EXISTS idx_transactions_datetime ON transactions (datetime, id);
+    """,
+    # 3: المجاميع اليومية حسب نوع الزبون، تُحدَّث داخل نفس المعاملة عبر triggers
+    """
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        day TEXT NOT NULL,
+        customer_type INTEGER NOT NULL,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        total_price REAL NOT NULL DEFAULT 0,
+        total_gas REAL NOT NULL DEFAULT 0,
+        large_qty INTEGER NOT NULL DEFAULT 0,
+        medium_qty INTEGER NOT NULL DEFAULT 0,
+        small_qty INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, customer_type)
+    ) WITHOUT ROWID;
+
+    """ + _ROLLUP_TRIGGERS + """
+    DELETE FROM daily_totals;
+    INSERT INTO daily_totals
+    SELECT substr(datetime, 1, 10), customer_type, COUNT(*),
+           SUM(total_price), SUM(total_gas),
+           SUM(large_qty), SUM(medium_qty), SUM(small_qty)
+    FROM transactions
+    GROUP BY substr(datetime, 1, 10), customer_type;
+    """,
+    # 4: جداول الأسعار حسب تاريخ بدء العمل بها
+    """
+    CREATE TABLE IF NOT EXISTS price_tables (
+        effective_date TEXT NOT NULL,
+        customer_type INTEGER NOT NULL,
+        large NUMERIC NOT NULL,
+        medium NUMERIC NOT NULL,
+        small NUMERIC NOT NULL,
+        PRIMARY KEY (effective_date, customer_type)
+    );
+
+    INSERT OR IGNORE INTO price_tables VALUES
+        ('1970-01-01', 0, 3330, 1600, 730),
+        ('1970-01-01', 1, 3130, 1505, 685),
+        ('1970-01-01', 2, 3200, 1535, 700);
+    """,
+    # 5: رقم إصدار لكل يوم يتغير مع كل إضافة أو حذف (للـ ETag)
+    """
+    CREATE TABLE IF NOT EXISTS day_changes (
+        day TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    ) WITHOUT ROWID;
+
+    """ + _DAY_CHANGES_TRIGGERS + """
+    INSERT OR IGNORE INTO day_changes
+    SELECT day, 1, CURRENT_TIMESTAMP FROM daily_totals GROUP BY day;
+    """,
+    # 6: datetime إجباري وبالصيغة 'YYYY-MM-DD HH:MM:SS' فقط، فاستعلامات المدى
+    # و substr(datetime, 1, 10) في الـ triggers تعتمد عليها.  SQLite لا يضيف
+    # CHECK لجدول موجود، لذلك يُعاد بناء الجدول؛ صيغ ISO الأخرى تُوحَّد
+    # بـ datetime() وأي قيمة غير صالحة توقف الهجرة.
+    """
+    DROP TABLE IF EXISTS transactions_new;
+    CREATE TABLE transactions_new (
+        id TEXT PRIMARY KEY,
+        datetime TEXT NOT NULL CHECK (datetime GLOB '""" + DATETIME_GLOB + """'),
+        customer_type INTEGER,
+        large_qty INTEGER,
+        medium_qty INTEGER,
+        small_qty INTEGER,
+        total_price REAL,
+        total_gas REAL
+    );
+    INSERT INTO transactions_new
+    SELECT id, COALESCE(datetime(datetime), datetime), customer_type,
+           large_qty, medium_qty, small_qty, total_price, total_gas
+    FROM transactions;
+    DROP TABLE transactions;
+    ALTER TABLE transactions_new RENAME TO transactions;
+    CREATE INDEX idx_transactions_datetime ON transactions (datetime, id);
+    """ + _ROLLUP_TRIGGERS + _DAY_CHANGES_TRIGGERS + """
+    DELETE FROM daily_totals;
+    INSERT INTO daily_totals
+    SELECT substr(datetime, 1, 10), customer_type, COUNT(*),
+           SUM(total_price), SUM(total_gas),
+           SUM(large_qty), SUM(medium_qty), SUM(small_qty)
+    FROM transactions
+    GROUP BY substr(datetime, 1, 10), customer_type;
+    INSERT OR IGNORE INTO day_changes
+    SELECT day, 1, CURRENT_TIMESTAMP FROM daily_totals GROUP BY day;
+    """,
+]
+
+# نفس التجميع المستعمل في الهجرة 3
+_DAILY_TOTALS_FROM_RAW = """
+    SELECT substr(datetime, 1, 10), customer_type, COUNT(*),
+           SUM(total_price), SUM(total_gas),
+           SUM(large_qty), SUM(medium_qty), SUM(small_qty)
+    FROM transactions
+    GROUP BY substr(datetime, 1, 10), customer_type
+"""
+
+COLUMNS = ("id", "datetime", "customer_type", "large_qty", "medium_qty",
+           "small_qty", "total_price", "total_gas")
+
+
+# إعدادات الاتصال: WAL حتى لا تنتظر القراءات خلف الكتابات
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# sqlite3 keeps prepared statements per connection keyed by the SQL text,
+# so every query in this module is a constant string.
+STATEMENT_CACHE_SIZE = 128
+POOL_SIZE = 8
+
+
+def connect(db_file, factory=sqlite3.Connection):
+    conn = sqlite3.connect(db_file, timeout=5, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """A small LIFO pool of tuned connections to one database file.
+
+    Connections are shared between threads one at a time, never
+    concurrently.  A pool inherited through ``fork`` is discarded so that
+    worker processes never reuse their parent's file handles.  The schema
+    is migrated lazily by the first connection the pool opens.
+    """
+
+    def __init__(self, db_file, size=POOL_SIZE, factory=sqlite3.Connection):
+        self.db_file = db_file
+        self.size = size
+        self.factory = factory
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect(self.db_file, self.factory)
+        # أول اتصال في كل عملية يتأكد من أن المخطط محدَّث
+        if not self._migrated:
+            with self._lock:
+                if not self._migrated:
+                    migrate(conn)
+                    self._migrated = True
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def init_app(app):
+    app.config.setdefault("DB_FILE", "database.db")
+    app.config.setdefault("DB_POOL_SIZE", POOL_SIZE)
+    app.extensions["storage"] = ConnectionPool(app.config["DB_FILE"],
+                                               app.config["DB_POOL_SIZE"])
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(db_cli)
+
+
+def get_pool():
+    return current_app.extensions["storage"]
+
+
+def get_db():
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def migrate(conn):
+    """Apply pending migrations, each one atomically with its version bump.
+
+    Every script is idempotent, so two processes racing on a fresh file
+    at worst repeat a step; ``BEGIN IMMEDIATE`` makes them take turns.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE;{script}PRAGMA user_version = {number};COMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db(db_file):
+    conn = connect(db_file)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def day_range(date):
+    """Return the half-open ``[start, end)`` bounds covering ``date``.
+
+    Raises ``ValueError`` when ``date`` is not a zero-padded ``YYYY-MM-DD``
+    string, so callers can use ``date`` itself as a ``daily_totals`` key.
+    """
+    start = datetime.strptime(date, DATE_FORMAT)
+    # strptime يقبل 2025-4-1 أيضا، لكن المفاتيح المخزنة دائما بالصيغة الكاملة
+    if start.strftime(DATE_FORMAT) != date:
+        raise ValueError(f"{date!r} is not a YYYY-MM-DD date")
+    end = start + timedelta(days=1)
+    return start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)
+
+
+def to_row(data):
+    return tuple(data[column] for column in COLUMNS)
+
+
+def delete_transaction_by_id(conn, transaction_id):
+    with conn:
+        conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+
+
+def get_day_totals(conn, date):
+    """Return ``(total_price, total_gas)`` for ``date`` from the rollup."""
+    cur = conn.execute("""
+        SELECT COALESCE(SUM(total_price), 0), COALESCE(SUM(total_gas), 0)
+        FROM daily_totals WHERE day = ?
+    """, (date,))
+    return cur.fetchone()
+
+
+def get_transactions_page(conn, date, after=None, limit=200):
+    """Return one keyset page of ``date``'s transactions.
+
+    ``after`` is the ``(datetime, id)`` of the last row already shown.
+    Returns ``(rows, next_after)`` where ``next_after`` is ``None`` on the
+    last page.
+    """
+    start, end = day_range(date)
+    after_time, after_id = after or (start, "")
+    cur = conn.execute("""
+        SELECT * FROM transactions
+        WHERE datetime >= ? AND datetime < ? AND (datetime, id) > (?, ?)
+        ORDER BY datetime, id
+        LIMIT ?
+    """, (start, end, after_time, after_id, limit + 1))
+    rows = cur.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1][1], rows[-1][0])
+    return rows, None
+
+
+def get_day_version(conn, date):
+    """Return ``(version, updated_at)`` for ``date``, ``(0, None)`` if unseen.
+
+    ``version`` grows with every insert, update or delete on that day and
+    ``updated_at`` is the UTC time of the last one.
+    """
+    row = conn.execute("SELECT version, updated_at FROM day_changes WHERE day = ?",
+                       (date,)).fetchone()
+    return row or (0, None)
+
+
+def rebuild_daily_totals(conn):
+    with conn:
+        conn.execute("DELETE FROM daily_totals")
+        conn.execute("INSERT INTO daily_totals" + _DAILY_TOTALS_FROM_RAW)
+    return conn.execute("SELECT COUNT(*) FROM daily_totals").fetchone()[0]
+
+
+def verify_daily_totals(conn, tolerance=1e-6):
+    """Compare ``daily_totals`` with the raw table.
+
+    Returns a list of ``(day, customer_type, expected, actual)`` tuples for
+    every key that differs; ``expected`` or ``actual`` is ``None`` when the
+    key is missing on that side.
+    """
+    expected = {row[:2]: row[2:] for row in conn.execute(_DAILY_TOTALS_FROM_RAW)}
+    actual = {row[:2]: row[2:] for row in conn.execute("""
+        SELECT day, customer_type, tx_count, total_price, total_gas,
+               large_qty, medium_qty, small_qty
+        FROM daily_totals
+    """)}
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        want, got = expected.get(key), actual.get(key)
+        if want is None or got is None or any(
+                abs((a or 0) - (b or 0)) > tolerance for a, b in zip(want, got)):
+            mismatches.append((*key, want, got))
+    return mismatches
+
+
+@click.group("db")
+def db_cli():
+    """Database maintenance commands."""
+
+
+@db_cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations."""
+    version = migrate(get_db())
+    click.echo(f"schema version {version}")
+
+
+@db_cli.command("rebuild-totals")
+def rebuild_totals_command():
+    """Recompute daily_totals from the transactions table."""
+    count = rebuild_daily_totals(get_db())
+    click.echo(f"rebuilt {count} daily_totals rows")
+
+
+@db_cli.command("verify-totals")
+def verify_totals_command():
+    """Check daily_totals against the transactions table."""
+    mismatches = verify_daily_totals(get_db())
+    for day, customer_type, want, got in mismatches:
+        click.echo(f"{day} type={customer_type} expected={want} actual={got}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} mismatched rows")
+    click.echo("daily_totals OK")
@@ -0,0 +1,17 @@
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "test.db")
+    storage.init_db(path)
+    return path
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = storage.connect(db_file)
+    yield conn
+    conn.close()
@@ -0,0 +1,119 @@
+import io
+import sqlite3
+
+import pytest
+
+import bulk
+import pricing
+
+HEADER = "id,datetime,customer_type,large_qty,medium_qty,small_qty,total_price,total_gas\n"
+
+
+def record(**fields):
+    return dict({"id": "a", "datetime": "2025-04-01 10:00:00", "customer_type": 0,
+                 "large_qty": 1, "medium_qty": 0, "small_qty": 0}, **fields)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-04-01 10:00:00", "2025-04-01 10:00:00"),
+    ("2025-04-01T10:00:00", "2025-04-01 10:00:00"),
+    ("2025-04-01", "2025-04-01 00:00:00"),
+    (" 2025-04-01 10:00:00.750 ", "2025-04-01 10:00:00"),
+])
+def test_datetimes_are_normalised(value, expected):
+    assert bulk.parse_record(record(datetime=value))[1] == expected
+
+
+@pytest.mark.parametrize("value", ["2025-04-01 10:00+01", "2025-04-01T10:00:00Z", "01/04/2025", ""])
+def test_bad_or_offset_datetimes_are_rejected(value):
+    with pytest.raises(bulk.InvalidRow):
+        bulk.parse_record(record(datetime=value))
+
+
+@pytest.mark.parametrize("value", [1.9, True, False, -1, "1.5", None, float("nan")])
+def test_bad_quantities_are_rejected(value):
+    with pytest.raises(bulk.InvalidRow):
+        bulk.parse_record(record(large_qty=value))
+
+
+def test_integral_values_are_accepted():
+    assert bulk.parse_record(record(customer_type="2", large_qty=3.0))[2:4] == (2, 3)
+
+
+def test_import_counts_offsets_as_invalid_not_duplicates(conn):
+    stream = io.StringIO(HEADER
+                         + "a,2025-04-01 10:00:00,0,1,0,0,,\n"
+                         + "b,2025-04-01 10:00+01,0,1,0,0,,\n"
+                         + "a,2025-04-01 11:00:00,0,1,0,0,,\n")
+    result = bulk.import_stream(conn, stream, "csv")
+    assert (result.read, result.inserted, result.duplicates, result.invalid) == (3, 1, 1, 1)
+    assert result.errors[0][0] == 3
+
+
+def test_constraint_failures_are_invalid_not_duplicates(conn, monkeypatch):
+    # تجاوز التحقق حتى يصل الصف الخاطئ إلى CHECK في الجدول
+    monkeypatch.setattr(bulk, "_parse_datetime", lambda value: value)
+    stream = io.StringIO(HEADER
+                         + "a,2025-04-01 10:00:00,0,1,0,0,,\n"
+                         + "b,2025-04-01 10:00+01,0,1,0,0,,\n"
+                         + "c,2025-04-01 12:00:00,0,1,0,0,,\n")
+    result = bulk.import_stream(conn, stream, "csv")
+    assert (result.inserted, result.duplicates, result.invalid) == (2, 0, 1)
+    assert "CHECK constraint failed" in result.errors[0][1]
+    assert [row[0] for row in conn.execute("SELECT id FROM transactions ORDER BY id")] == ["a", "c"]
+
+
+def test_insert_only_skips_id_conflicts(conn):
+    row = ("a", "2025-04-01 10:00:00", 0, 1, 0, 0, 3330.0, 0.012)
+    with conn:
+        assert conn.execute(bulk._INSERT, row).rowcount == 1
+        assert conn.execute(bulk._INSERT, row).rowcount == 0
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute(bulk._INSERT, ("b", "2025-04-01 10:00+01") + row[2:])
+
+
+def parsed(price=None, gas=None, customer_type=0, when="2025-04-01 10:00:00", transaction_id="a"):
+    return (transaction_id, when, customer_type, 1, 1, 0, price, gas)
+
+
+@pytest.fixture
+def book():
+    return pricing.PriceBook([("1970-01-01", 0, 3330, 1600, 730)])
+
+
+def test_missing_totals_are_filled_in(book):
+    rows, errors, warnings = bulk.price_records(book, [parsed()])
+    assert rows[0][6:] == pytest.approx((4930.0, 0.018))
+    assert errors == warnings == []
+
+
+def test_totals_within_tolerance_are_accepted(book):
+    rows, errors, _ = bulk.price_records(book, [parsed(4930.005, 0.018 + 1e-9)])
+    assert len(rows) == 1 and errors == []
+    assert rows[0][6] == 4930.0
+
+
+def test_mismatched_totals_are_rejected_by_default(book):
+    rows, errors, warnings = bulk.price_records(book, [parsed(4930.02), parsed(4930, 0.02, transaction_id="b")])
+    assert rows == [] and warnings == []
+    assert [position for position, _ in errors] == [0, 1]
+
+
+def test_recompute_replaces_mismatched_totals(book):
+    rows, errors, warnings = bulk.price_records(book, [parsed(1, 1)], recompute=True)
+    assert rows[0][6:] == pytest.approx((4930.0, 0.018))
+    assert errors == warnings == []
+
+
+def test_keep_totals_stores_given_totals_with_a_warning(book):
+    rows, errors, warnings = bulk.price_records(book, [parsed(1.0), parsed(transaction_id="b")], keep_totals=True)
+    assert errors == []
+    assert [position for position, _ in warnings] == [0]
+    assert rows[0][6:] == pytest.approx((1.0, 0.018))
+    assert rows[1][6] == 4930.0
+
+
+def test_unpriced_sales_are_errors_even_when_keeping_totals(book):
+    rows, errors, warnings = bulk.price_records(book, [parsed(10.0, customer_type=5)], keep_totals=True)
+    assert rows == [] and warnings == []
+    assert "no price for customer_type 5" in errors[0][1]
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import pricing
+
+ROWS = [
+    ("1970-01-01", 0, 3330, 1600, 730),
+    ("1970-01-01", 1, 3130, 1505, 685),
+    ("2025-06-01", 0, 3400, 1650, 750),
+    ("2025-09-01", 2, 3200, 1535, 700),
+]
+
+
+@pytest.fixture
+def book():
+    return pricing.PriceBook(ROWS)
+
+
+def test_versions_carry_earlier_types_forward(book):
+    assert book.dates == ["1970-01-01", "2025-06-01", "2025-09-01"]
+    assert book.prices_on("2025-05-31")[0]["large"] == 3330
+    assert book.prices_on("2025-06-01")[0]["large"] == 3400
+    assert book.prices_on("2025-09-01")[1]["large"] == 3130
+    assert 2 not in book.prices_on("2025-08-31")
+
+
+def test_quote_batch_picks_the_version_of_each_date(book):
+    dates = np.array(["2025-05-31 23:59:59", "2025-06-01 00:00:00", "2025-12-31 10:00:00"])
+    prices, gas = book.quote_batch([0, 0, 0], [1, 1, 1], [0, 0, 0], [0, 0, 0], dates=dates)
+    assert prices.tolist() == [3330, 3400, 3400]
+    assert gas.tolist() == pytest.approx([0.012] * 3)
+
+
+def test_quote_batch_single_date_applies_to_every_sale(book):
+    prices, _ = book.quote_batch([0, 1], [1, 1], [0, 0], [0, 0], dates="2025-07-01")
+    assert prices.tolist() == [3400, 3130]
+
+
+def test_unknown_types_and_dates_before_any_table_are_nan(book):
+    dates = np.array(["2025-07-01", "2025-07-01", "2025-10-01", "1969-12-31", "2025-07-01"])
+    prices, gas = book.quote_batch([2, 7, 2, 0, -1], [1] * 5, [0] * 5, [0] * 5, dates=dates)
+    assert np.isnan(prices).tolist() == [True, True, False, True, True]
+    assert not np.isnan(gas).any()
+    with pytest.raises(KeyError):
+        book.quote(2, 1, 0, 0, date="2025-07-01")
+
+
+def test_scalar_and_batch_quotes_agree(book):
+    rng = np.random.default_rng(0)
+    types = rng.integers(0, 3, 200)
+    quantities = rng.integers(0, 8, (3, 200))
+    days = np.datetime64("2025-01-01") + rng.integers(0, 365, 200)
+    dates = np.datetime_as_string(days)
+    prices, gas = book.quote_batch(types, *quantities, dates=dates)
+    for i in range(200):
+        try:
+            price, weight = book.quote(int(types[i]), *(int(q) for q in quantities[:, i]), date=dates[i])
+        except KeyError:
+            assert np.isnan(prices[i])
+            continue
+        assert prices[i] == pytest.approx(price)
+        assert gas[i] == pytest.approx(weight)
+
+
+def test_set_prices_stores_canonical_rows(conn):
+    pricing.set_prices(conn, "2026-01-05", 0, 3400, 1650, 750)
+    book = pricing.load_price_book(conn)
+    assert book.prices_on("2026-01-05")[0] == {"large": 3400, "medium": 1650, "small": 750}
+    assert book.prices_on("2026-01-04")[0]["large"] == 3330
+
+
+@pytest.mark.parametrize("args", [
+    ("2026-1-5", 0, 3400, 1650, 750),
+    ("2026-01-05", -1, 3400, 1650, 750),
+    ("2026-01-05", 0, 3400, -1, 750),
+])
+def test_set_prices_rejects_bad_input(conn, args):
+    with pytest.raises(ValueError):
+        pricing.set_prices(conn, *args)
+    assert len(pricing.load_price_book(conn).versions) == 1
+
+
+def test_price_cache_reloads_after_another_process_writes(conn):
+    cache = pricing.PriceCache(check_interval=0)
+    first = cache.get(conn)
+    assert cache.get(conn) is first
+    pricing.set_prices(conn, "2026-01-05", 1, 3200, 1550, 700)
+    assert cache.get(conn) is not first
+    assert cache.get(conn).prices_on("2026-01-05")[1]["large"] == 3200
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+import reports
+
+
+def insert(conn, *days):
+    with conn:
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, 0, 1, 0, 0, 3330.0, 0.012)",
+                         [(f"{day}-{i}", f"{day} 10:00:00") for i, day in enumerate(days)])
+
+
+def by_slot(frame):
+    return {row["slot"]: row for row in frame.to_dict(orient="records")}
+
+
+def test_year_over_year_weeks_follow_iso_years(conn):
+    insert(conn, "2024-01-02", "2024-12-31", "2025-01-02", "2025-01-08")
+    result = reports.year_over_year(conn, 2025, "week")
+    assert list(result["slot"]) == ["W01", "W02"]
+    rows = by_slot(result)
+    # 2024-12-31 يقع في الأسبوع الأول من سنة ISO 2025
+    assert rows["W01"]["period"] == pd.Timestamp("2024-12-30")
+    assert (rows["W01"]["tx_count"], rows["W01"]["tx_count_previous"]) == (2, 1)
+    assert rows["W01"]["revenue_growth"] == pytest.approx(1.0)
+    assert rows["W02"]["tx_count"] == 1 and pd.isna(rows["W02"]["tx_count_previous"])
+
+
+def test_year_over_year_includes_iso_week_53(conn):
+    # سنة ISO 2020 فيها 53 أسبوعا من 2019-12-30 إلى 2021-01-03، وسنة 2019 تبدأ في 2018-12-31
+    insert(conn, "2021-01-03", "2019-12-30", "2018-12-31")
+    rows = by_slot(reports.year_over_year(conn, 2020, "week"))
+    assert rows["W53"]["tx_count"] == 1 and pd.isna(rows["W53"]["tx_count_previous"])
+    assert (rows["W01"]["tx_count"], rows["W01"]["tx_count_previous"]) == (1, 1)
+
+
+def test_year_over_year_months(conn):
+    insert(conn, "2024-03-05", "2025-03-01", "2025-03-31", "2025-04-01")
+    rows = by_slot(reports.year_over_year(conn, 2025, "month"))
+    assert (rows["03"]["tx_count"], rows["03"]["tx_count_previous"]) == (2, 1)
+    assert rows["04"]["tx_count"] == 1
+
+
+def test_aggregate_by_type_and_mix(conn):
+    insert(conn, "2025-03-01", "2025-04-01")
+    frame = reports.load_range(conn, "2025-03-01", "2025-05-01")
+    rows = reports.aggregate(frame, "month")
+    assert rows["tx_count"].tolist() == [1, 1]
+    assert rows["large_share"].tolist() == [1.0, 1.0]
+    assert rows["revenue_change"].fillna(0).tolist() == [0.0, 0.0]
+
+
+def test_snapshots_are_rebuilt_after_a_late_write(conn, tmp_path):
+    store = reports.SnapshotStore(str(tmp_path / "snapshots"))
+    insert(conn, "2025-01-10")
+    first = reports.load_range(conn, "2025-01-01", "2025-02-01", store, today="2025-06-01")
+    assert first["tx_count"].sum() == 1
+    with conn:
+        conn.execute("INSERT INTO transactions VALUES ('late', '2025-01-20 10:00:00', 1, 1, 0, 0, 3130.0, 0.012)")
+    second = reports.load_range(conn, "2025-01-01", "2025-02-01", store, today="2025-06-01")
+    assert second["tx_count"].sum() == 2
+
+
+@pytest.mark.parametrize("start, end", [
+    ("0001-01-01", "2025-01-01"),
+    ("2025-01-01", "9999-01-01"),
+    ("2025-02-01", "2025-01-01"),
+    ("2000-01-01", "2025-01-01"),
+    ("2025-1-1", "2025-02-01"),
+    (None, "2025-02-01"),
+])
+def test_check_range_rejects(start, end):
+    with pytest.raises(ValueError):
+        reports.check_range(start, end, today="2025-06-01")
+
+
+def test_check_range_accepts():
+    assert reports.check_range("2024-01-01", "2026-06-01", today="2025-06-01") == (
+        pd.Timestamp("2024-01-01"), pd.Timestamp("2026-06-01"))
+
+
+def test_check_year():
+    reports.check_year(2026, today="2025-06-01")
+    for year in (1970, 2027, 99999):
+        with pytest.raises(ValueError):
+            reports.check_year(year, today="2025-06-01")
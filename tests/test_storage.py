@@ -0,0 +1,174 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+# المخطط كما كان قبل الهجرات (app.py الأصلي)
+BASELINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id TEXT PRIMARY KEY,
+        datetime TEXT,
+        customer_type INTEGER,
+        large_qty INTEGER,
+        medium_qty INTEGER,
+        small_qty INTEGER,
+        total_price REAL,
+        total_gas REAL
+    )
+"""
+
+
+def sale(transaction_id, when, customer_type=0, large=1, medium=0, small=0):
+    return (transaction_id, when, customer_type, large, medium, small,
+            large * 3330.0 + medium * 1600.0 + small * 730.0,
+            (large * 12 + medium * 6 + small * 2.7) / 1000)
+
+
+def insert(conn, *rows):
+    with conn:
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def rollup(conn):
+    return {row[:2]: row[2:] for row in conn.execute("""
+        SELECT day, customer_type, tx_count, total_price, large_qty
+        FROM daily_totals
+    """)}
+
+
+def test_migrate_from_baseline(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(BASELINE_SCHEMA)
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+            sale("a", "2025-04-01 10:00:00"),
+            sale("b", "2025-04-01T11:30:00", customer_type=1),
+            sale("c", "2025-04-02", large=2),
+        ])
+    conn.close()
+
+    assert storage.init_db(path) == len(storage.MIGRATIONS)
+    assert storage.init_db(path) == len(storage.MIGRATIONS)
+
+    conn = storage.connect(path)
+    try:
+        assert conn.execute("SELECT id, datetime FROM transactions ORDER BY id").fetchall() == [
+            ("a", "2025-04-01 10:00:00"),
+            ("b", "2025-04-01 11:30:00"),
+            ("c", "2025-04-02 00:00:00"),
+        ]
+        assert storage.verify_daily_totals(conn) == []
+        assert rollup(conn) == {
+            ("2025-04-01", 0): (1, 3330.0, 1),
+            ("2025-04-01", 1): (1, 3330.0, 1),
+            ("2025-04-02", 0): (1, 6660.0, 2),
+        }
+        assert storage.get_day_version(conn, "2025-04-02")[0] == 1
+        assert {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")} == {
+            "trg_transactions_insert", "trg_transactions_delete", "trg_transactions_update",
+            "trg_day_changes_insert", "trg_day_changes_delete", "trg_day_changes_update",
+        }
+    finally:
+        conn.close()
+
+
+def test_migration_stops_on_unreadable_datetime(tmp_path):
+    path = str(tmp_path / "bad.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(BASELINE_SCHEMA)
+        conn.execute("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sale("a", "yesterday"))
+    conn.close()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        storage.init_db(path)
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(storage.MIGRATIONS) - 1
+        assert conn.execute("SELECT datetime FROM transactions").fetchall() == [("yesterday",)]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("when", [None, "2025-04-01", "2025-04-01T10:00:00", "2025-4-1 10:00:00"])
+def test_datetime_must_be_canonical(conn, when):
+    with pytest.raises(sqlite3.IntegrityError):
+        insert(conn, sale("a", when))
+
+
+def test_triggers_keep_rollup_consistent(conn):
+    insert(conn,
+           sale("a", "2025-04-01 10:00:00"),
+           sale("b", "2025-04-01 11:00:00", large=2),
+           sale("c", "2025-04-02 09:00:00", customer_type=2))
+    assert rollup(conn) == {
+        ("2025-04-01", 0): (2, 9990.0, 3),
+        ("2025-04-02", 2): (1, 3330.0, 1),
+    }
+
+    with conn:
+        conn.execute("UPDATE transactions SET datetime = '2025-04-02 12:00:00', customer_type = 2 WHERE id = 'b'")
+    assert rollup(conn) == {
+        ("2025-04-01", 0): (1, 3330.0, 1),
+        ("2025-04-02", 2): (2, 9990.0, 3),
+    }
+
+    storage.delete_transaction_by_id(conn, "a")
+    assert ("2025-04-01", 0) not in rollup(conn)
+    assert storage.get_day_totals(conn, "2025-04-01") == (0, 0)
+    assert storage.verify_daily_totals(conn) == []
+
+
+def test_day_version_changes_with_every_write(conn):
+    assert storage.get_day_version(conn, "2025-04-01") == (0, None)
+    insert(conn, sale("a", "2025-04-01 10:00:00"))
+    insert(conn, sale("b", "2025-04-01 11:00:00"))
+    storage.delete_transaction_by_id(conn, "a")
+    assert storage.get_day_version(conn, "2025-04-01")[0] == 3
+
+
+def test_ignored_duplicate_leaves_rollup_alone(conn):
+    insert(conn, sale("a", "2025-04-01 10:00:00"))
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     sale("a", "2025-04-01 10:00:00", large=5))
+    assert rollup(conn) == {("2025-04-01", 0): (1, 3330.0, 1)}
+    assert storage.get_day_version(conn, "2025-04-01")[0] == 1
+
+
+def test_verify_and_rebuild_daily_totals(conn):
+    insert(conn, sale("a", "2025-04-01 10:00:00"), sale("b", "2025-04-03 10:00:00"))
+    with conn:
+        conn.execute("UPDATE daily_totals SET tx_count = 7 WHERE day = '2025-04-01'")
+        conn.execute("DELETE FROM daily_totals WHERE day = '2025-04-03'")
+        conn.execute("INSERT INTO daily_totals (day, customer_type) VALUES ('2025-04-05', 1)")
+
+    mismatches = storage.verify_daily_totals(conn)
+    assert [(day, customer_type) for day, customer_type, _, _ in mismatches] == [
+        ("2025-04-01", 0), ("2025-04-03", 0), ("2025-04-05", 1)]
+    assert mismatches[1][3] is None and mismatches[2][2] is None
+
+    assert storage.rebuild_daily_totals(conn) == 2
+    assert storage.verify_daily_totals(conn) == []
+
+
+def test_transactions_page_walks_the_day_in_order(conn):
+    insert(conn, *[sale(f"id{i}", f"2025-04-01 10:00:{i % 3:02d}") for i in range(7)],
+           sale("other", "2025-04-02 00:00:00"))
+    seen, after = [], None
+    while True:
+        rows, after = storage.get_transactions_page(conn, "2025-04-01", after, limit=3)
+        seen += [row[0] for row in rows]
+        if after is None:
+            break
+    assert seen == ["id0", "id3", "id6", "id1", "id4", "id2", "id5"]
+
+
+@pytest.mark.parametrize("date", ["2025-4-1", "2025-04-1", " 2025-04-01", "2025-04-01 00:00:00", "2025-02-30"])
+def test_day_range_is_strict(date):
+    with pytest.raises(ValueError):
+        storage.day_range(date)
+
+
+def test_day_range():
+    assert storage.day_range("2024-12-31") == ("2024-12-31", "2025-01-01")
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+import writer
+
+
+def sale(transaction_id, when="2025-04-01 10:00:00"):
+    return (transaction_id, when, 0, 1, 0, 0, 3330.0, 0.012)
+
+
+@pytest.fixture
+def queue(db_file):
+    queue = writer.WriteBehindQueue(db_file, flush_interval=0.2)
+    yield queue
+    queue.close()
+
+
+def stored_ids(db_file):
+    conn = storage.connect(db_file)
+    try:
+        return [row[0] for row in conn.execute("SELECT id FROM transactions ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_ack_flags_inserted_rows_and_duplicates(queue, db_file):
+    assert queue.submit(sale("a")).result(timeout=5) == [True]
+    assert queue.submit_many([sale("a"), sale("b"), sale("b")]).result(timeout=5) == [False, True, False]
+    assert stored_ids(db_file) == ["a", "b"]
+
+    conn = storage.connect(db_file)
+    try:
+        assert storage.verify_daily_totals(conn) == []
+        assert storage.get_day_totals(conn, "2025-04-01") == (6660.0, 0.024)
+    finally:
+        conn.close()
+
+
+def test_concurrent_submissions_share_a_transaction(queue, db_file):
+    futures = [queue.submit(sale(f"id{i}")) for i in range(20)]
+    assert [future.result(timeout=5) for future in futures] == [[True]] * 20
+    stats = queue.stats()
+    assert stats["rows"] == 20 and stats["submissions"] == 20
+    assert stats["batches"] < 20
+    assert len(stored_ids(db_file)) == 20
+
+
+def test_bad_submission_fails_alone(queue, db_file):
+    good = queue.submit(sale("a"))
+    bad = queue.submit_many([("b",)])
+    other = queue.submit(sale("c"))
+    assert good.result(timeout=5) == [True]
+    assert other.result(timeout=5) == [True]
+    with pytest.raises(sqlite3.ProgrammingError):
+        bad.result(timeout=5)
+    assert stored_ids(db_file) == ["a", "c"]
+    assert queue.stats()["failed_batches"] >= 1
+
+
+def test_constraint_failure_reaches_the_future(queue, db_file):
+    future = queue.submit(sale("a", "2025-04-01 10:00+01"))
+    with pytest.raises(sqlite3.IntegrityError):
+        future.result(timeout=5)
+    assert stored_ids(db_file) == []
+
+
+def test_listener_runs_after_ack_and_cannot_fail_it(queue):
+    calls, futures = [], []
+    submitted = threading.Event()
+
+    def broken(days):
+        raise RuntimeError("listener failed")
+
+    def record(days):
+        # ننتظر حتى يعرف الاختبار الـ Future، ثم نسجّل هل حُسم قبل المستمع
+        submitted.wait(5)
+        calls.append((days, futures[0].done()))
+
+    queue.listeners += [broken, record]
+    futures.append(queue.submit_many([sale("a"), sale("b", "2025-04-02 09:00:00")]))
+    submitted.set()
+    assert futures[0].result(timeout=5) == [True, True]
+    queue.close()
+    assert calls == [({"2025-04-01", "2025-04-02"}, True)]
+
+
+def test_factory_opens_the_writer_connection(db_file):
+    opened = []
+
+    class Connection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+
+    queue = writer.WriteBehindQueue(db_file)
+    queue.factory = Connection
+    try:
+        assert queue.submit(sale("a")).result(timeout=5) == [True]
+    finally:
+        queue.close()
+    assert len(opened) == 1
@@ -0,0 +1,211 @@
+from concurrent.futures import Future
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+import storage
+
+MAX_BATCH_ROWS = 1000
+FLUSH_INTERVAL = 0.002
+MAX_QUEUE = 10000
+WRITE_TIMEOUT = 10
+
+# مثل bulk: تكرار id فقط يُتجاهل، وأي مخالفة أخرى تصل إلى الـ Future كخطأ
+_INSERT = """
+    INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Coalesce concurrent inserts into shared transactions.
+
+    Every ``submit`` returns a ``Future`` that resolves to one flag per
+    row, ``True`` where the row was inserted and ``False`` where its id
+    already existed, once the transaction holding them has been committed
+    with ``synchronous=FULL``, so a resolved future is a durability
+    acknowledgement.
+
+    A single background thread owns the connection.  It takes whatever is
+    queued, waits at most ``flush_interval`` seconds for more work, and
+    commits up to ``max_batch_rows`` rows at once.
+    """
+
+    def __init__(self, db_file, max_batch_rows=MAX_BATCH_ROWS,
+                 flush_interval=FLUSH_INTERVAL, max_queue=MAX_QUEUE,
+                 factory=sqlite3.Connection):
+        self.db_file = db_file
+        # يُقرأ عند فتح الاتصال في الخيط، فيمكن تغييره بعد init_app (القياسات)
+        self.factory = factory
+        self.max_batch_rows = max_batch_rows
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        # تُستدعى بعد كل commit مع مجموعة الأيام التي تغيرت
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._queue = None
+        self._stats = {
+            "batches": 0,
+            "rows": 0,
+            "submissions": 0,
+            "failed_batches": 0,
+            "last_batch_rows": 0,
+            "max_batch_rows": 0,
+            "max_queue_depth": 0,
+            "commit_seconds": 0.0,
+        }
+
+    def _ensure_started(self):
+        # الخيط لا يعيش بعد fork، لذلك يُشغَّل من جديد في كل عملية
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        return self.submit_many([row])
+
+    def submit_many(self, rows):
+        """Queue ``rows`` to be committed together in one transaction."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((list(rows), future))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats["submissions"] += 1
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        stats["mean_batch_rows"] = stats["rows"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def close(self, timeout=WRITE_TIMEOUT):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _collect(self, first):
+        batch, rows = [first], len(first[0])
+        deadline = time.monotonic() + self.flush_interval
+        while rows < self.max_batch_rows:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            rows += len(item[0])
+        return batch, False
+
+    def _write(self, conn, batch):
+        started = time.perf_counter()
+        # commit() صريح بدل "with conn" حتى يمر عبر factory (القياسات)
+        try:
+            inserted = [[conn.execute(_INSERT, row).rowcount == 1 for row in rows]
+                        for rows, _ in batch]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                self._stats["failed_batches"] += 1
+            if len(batch) == 1:
+                raise
+            # نعيد كل طلب وحده حتى لا يُفسد طلب خاطئ بقية الدفعة
+            for item in batch:
+                self._resolve(conn, [item])
+            return
+        elapsed = time.perf_counter() - started
+        size = sum(len(rows) for rows, _ in batch)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["rows"] += size
+            self._stats["last_batch_rows"] = size
+            self._stats["max_batch_rows"] = max(self._stats["max_batch_rows"], size)
+            self._stats["commit_seconds"] += elapsed
+        for (_, future), flags in zip(batch, inserted):
+            future.set_result(flags)
+        # بعد الـ commit لا يجوز أن يُعلَّم طلب كفاشل بسبب مستمع
+        days = {row[1][:10] for rows, _ in batch for row in rows}
+        for listener in self.listeners:
+            try:
+                listener(days)
+            except Exception:
+                logger.exception("write-behind listener %r failed", listener)
+
+    def _resolve(self, conn, batch):
+        try:
+            self._write(conn, batch)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+    def _run(self):
+        conn = storage.connect(self.db_file, self.factory)
+        conn.execute("PRAGMA synchronous = FULL")
+        try:
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch, stop = self._collect(first)
+                self._resolve(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+
+def init_app(app):
+    app.config.setdefault("WRITER_MAX_BATCH_ROWS", MAX_BATCH_ROWS)
+    app.config.setdefault("WRITER_FLUSH_INTERVAL", FLUSH_INTERVAL)
+    app.config.setdefault("WRITER_MAX_QUEUE", MAX_QUEUE)
+    app.config.setdefault("WRITE_TIMEOUT", WRITE_TIMEOUT)
+    writer = WriteBehindQueue(app.config["DB_FILE"],
+                              max_batch_rows=app.config["WRITER_MAX_BATCH_ROWS"],
+                              flush_interval=app.config["WRITER_FLUSH_INTERVAL"],
+                              max_queue=app.config["WRITER_MAX_QUEUE"])
+    app.extensions["writer"] = writer
+    atexit.register(writer.close)
+
+
+def get_writer():
+    return current_app.extensions["writer"]
+
+
+def write(rows):
+    """Commit ``rows`` through the app's queue and wait for the ack.
+
+    Returns one flag per row, ``False`` for ids that already existed.
+    """
+    future = get_writer().submit_many(rows)
+    return future.result(timeout=current_app.config["WRITE_TIMEOUT"])